@@ -0,0 +1,345 @@
+import asyncio
+import time
+from threading import Lock, Thread
+
+import grpc
+
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
+from election import IdSharingServicer, LeaderIdSharingServicer
+from gamemaster import GameMasterServicer
+from player import PlayerServicer
+from set_timeout import TimeOutServicer
+from node import Node
+from channels import CHANNEL_OPTIONS
+from metrics import AioServerInterceptor, method_name
+
+import time_sync
+
+
+_loop = None
+_loop_lock = Lock()
+
+
+# grpc.aio polls on a single event loop per process, so all the nodes of a process share one
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            Thread(target=_loop.run_forever, daemon=True).start()
+    return _loop
+
+
+def _in_loop(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+# grpc.aio counterpart of ChannelPool. The async methods run on the node's event loop.
+# The blocking `call`/`broadcast` keep the ChannelPool interface for code running outside
+# of the loop (commands, timers); on the loop itself they send without waiting for the response.
+class AioChannelPool:
+    def __init__(self, node, loop):
+        self.node = node
+        self.loop = loop
+        self._channels = {}
+        self._stubs = {}
+        self._tasks = set()
+
+    def channel(self, node_id):
+        channel = self._channels.get(node_id)
+        if channel is None:
+            channel = grpc.aio.insecure_channel(self.node.get_node_ip(node_id), options=CHANNEL_OPTIONS)
+            self._channels[node_id] = channel
+        return channel
+
+    def stub(self, node_id, stub_cls):
+        key = (node_id, stub_cls)
+        stub = self._stubs.get(key)
+        if stub is None:
+            stub = stub_cls(self.node.stub_channel(self.channel(node_id)))
+            self._stubs[key] = stub
+        return stub
+
+    async def acall(self, node_id, stub_cls, method, request, timeout=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            res = await getattr(self.stub(node_id, stub_cls), method)(request, timeout=timeout)
+            failed = False
+            return res
+        finally:
+            self.node.metrics.observe('client', method_name(stub_cls, method), time.perf_counter() - started, failed)
+
+    async def abroadcast(self, node_ids, stub_cls, method, request, timeout=None):
+        node_ids = list(node_ids)
+        responses = await asyncio.gather(
+            *(self.acall(node_id, stub_cls, method, request[node_id] if isinstance(request, dict) else request,
+                         timeout) for node_id in node_ids),
+            return_exceptions=True)
+        results = {}
+        failures = {}
+        for node_id, res in zip(node_ids, responses):
+            if isinstance(res, grpc.RpcError):
+                failures[node_id] = res
+            elif isinstance(res, BaseException):
+                raise res
+            else:
+                results[node_id] = res
+        return results, failures
+
+    async def asend_to_next_alive(self, ring_ids, stub_cls, method, request, timeout=None):
+        for next_node_id in ring_ids:
+            try:
+                return await self.acall(next_node_id, stub_cls, method, request, timeout)
+            except grpc.RpcError:
+                print(f'Node {next_node_id} is not responding, skipping it')
+                continue
+        return None
+
+    def cast_to_next_alive(self, node_ids, stub_cls, method, request, timeout=None):
+        coro = self.asend_to_next_alive(list(node_ids), stub_cls, method, request, timeout)
+        self.loop.call_soon_threadsafe(self.spawn, coro)
+
+    def call(self, node_id, stub_cls, method, request, timeout=None):
+        return self._run(self.acall(node_id, stub_cls, method, request, timeout), None)
+
+    def broadcast(self, node_ids, stub_cls, method, request, timeout=None):
+        return self._run(self.abroadcast(list(node_ids), stub_cls, method, request, timeout), ({}, {}))
+
+    def spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._forget)
+        return task
+
+    def _forget(self, task):
+        self._tasks.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        if isinstance(task.exception(), grpc.RpcError):
+            print(f'Call failed: {task.exception().code()}')
+        else:
+            print(f'Background task failed: {task.exception()!r}')
+
+    def _run(self, coro, result_in_loop):
+        if _in_loop(self.loop):
+            self.spawn(coro)
+            return result_in_loop
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def aclose(self):
+        channels = list(self._channels.values())
+        self._channels.clear()
+        self._stubs.clear()
+        for channel in channels:
+            await channel.close()
+
+
+# The handlers that take the lock of a game or wait for the move log run on a thread of the executor: a thread
+# holding the lock may wait for the loop, e.g. to call a player, so the loop itself must never wait for the lock
+def _off_loop(node, handler, *args):
+    return node.loop.run_in_executor(None, handler, *args)
+
+
+class AsyncSubscriber:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    # Events are published from gRPC handlers as well as from timer threads
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class AsyncIdSharingServicer(IdSharingServicer):
+    async def ShareId(self, request, context):
+        return super().ShareId(request, context)
+
+
+class AsyncLeaderIdSharingServicer(LeaderIdSharingServicer):
+    async def ShareLeaderId(self, request, context):
+        return super().ShareLeaderId(request, context)
+
+    async def NotifyLeader(self, request, context):
+        return await _off_loop(self.node, super().NotifyLeader, request, context)
+
+
+class AsyncGameMasterServicer(GameMasterServicer):
+    async def SetSymbol(self, request, context):
+        return await _off_loop(self.node, super().SetSymbol, request, context)
+
+    async def ListBoard(self, request, context):
+        return await _off_loop(self.node, super().ListBoard, request, context)
+
+    async def SetSymbolBatch(self, request, context):
+        return await _off_loop(self.node, super().SetSymbolBatch, request, context)
+
+    async def ListBoards(self, request, context):
+        return await _off_loop(self.node, super().ListBoards, request, context)
+
+    async def PlayStream(self, request_iterator, context):
+        async for request in request_iterator:
+            yield await _off_loop(self.node, self.play, request)
+
+    async def SuggestMove(self, request, context):
+        return super().SuggestMove(request, context)
+
+    async def Enqueue(self, request, context):
+        return super().Enqueue(request, context)
+
+    async def Subscribe(self, request, context):
+        subscriber = self.node.events.subscribe(request.node_id, AsyncSubscriber(self.node.loop))
+        interval = request.heartbeat_interval or self.node.heartbeat_interval
+        heartbeat = tictactoe_pb2.GameEvent(type=tictactoe_pb2.GameEvent.HEARTBEAT)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber.get(), interval)
+                except asyncio.TimeoutError:
+                    yield heartbeat
+        finally:
+            self.node.events.unsubscribe(request.node_id, subscriber)
+
+
+class AsyncPlayerServicer(PlayerServicer):
+    async def SendMessage(self, request, context):
+        return super().SendMessage(request, context)
+
+    async def EndGame(self, request, context):
+        return super().EndGame(request, context)
+
+    async def ExitGame(self, request, context):
+        return super().ExitGame(request, context)
+
+    async def VerifyLeaderIsDown(self, request, context):
+        return super().VerifyLeaderIsDown(request, context)
+
+    async def Replicate(self, request, context):
+        return super().Replicate(request, context)
+
+
+class AsyncTimeSyncServicer(time_sync.TimeSyncServicer):
+    async def GetOffset(self, request, context):
+        return super().GetOffset(request, context)
+
+    async def SetOffset(self, request, context):
+        return super().SetOffset(request, context)
+
+    async def AdjustOffset(self, request, context):
+        return super().AdjustOffset(request, context)
+
+
+class AsyncTimeOutServicer(TimeOutServicer):
+    async def SetTimeOut(self, request, context):
+        return super().SetTimeOut(request, context)
+
+
+# Node served by grpc.aio on the event loop running in a background thread.
+# Handlers never block on outbound calls, so in-flight RPCs are not limited by a worker pool.
+class AsyncNode(Node):
+    def __init__(self, id, ring_ids, ip=None, ring_ips=None, port=None, addresses=None):
+        self.loop = get_event_loop()
+        super().__init__(id, ring_ids, ip, ring_ips, port, addresses)
+
+    def create_channel_pool(self):
+        return AioChannelPool(self, self.loop)
+
+    def create_server(self):
+        return asyncio.run_coroutine_threadsafe(self._create_server(), self.loop).result()
+
+    async def _create_server(self):
+        server = grpc.aio.server(interceptors=[AioServerInterceptor(self.metrics)])
+
+        self.add_servicers(server, [
+            (tictactoe_pb2_grpc.add_IdSharingServicer_to_server, AsyncIdSharingServicer(self)),
+            (tictactoe_pb2_grpc.add_LeaderIdSharingServicer_to_server, AsyncLeaderIdSharingServicer(self)),
+            (tictactoe_pb2_grpc.add_GameMasterServicer_to_server, AsyncGameMasterServicer(self)),
+            (tictactoe_pb2_grpc.add_PlayerServicer_to_server, AsyncPlayerServicer(self)),
+            (tictactoe_pb2_grpc.add_TimeSyncServicer_to_server, AsyncTimeSyncServicer(self)),
+            (tictactoe_pb2_grpc.add_TimeOutServicer_to_server, AsyncTimeOutServicer(self)),
+        ])
+
+        self.bind(server)
+        return server
+
+    def start_server(self):
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+        print(f'Started node with id {self.id} (asyncio)')
+        print(f'Listening on port {self.port}...')
+
+    def stop_server(self):
+        future = asyncio.run_coroutine_threadsafe(self._stop_server(), self.loop)
+        if not _in_loop(self.loop):
+            future.result()
+        # Shutting down waits for the serving thread, which must not block the loop
+        if self.metrics_server:
+            Thread(target=self.metrics_server.shutdown, daemon=True).start()
+        self.timers.stop()
+        self.auto_moves.shutdown(wait=False)
+        # Their calls are made through the loop, which must not wait for them
+        self.lobby.close(wait=not _in_loop(self.loop))
+        self.replicator.close(wait=not _in_loop(self.loop))
+        # Everything that makes calls is stopped before the channels are closed
+        future = asyncio.run_coroutine_threadsafe(self.channels.aclose(), self.loop)
+        if not _in_loop(self.loop):
+            future.result()
+        if self.move_log:
+            self.move_log.close()
+        if self.archive:
+            self.archive.close()
+        print(f'Stopped node with id {self.id}')
+
+    async def _stop_server(self):
+        if self.subscription is not None:
+            self.subscription.cancel()
+        await self.server.stop(0)
+
+    # The commands below make blocking calls,
+    # when they are triggered from a handler they continue on an executor thread
+    def start_election(self, wait=True):
+        if wait and _in_loop(self.loop):
+            self.loop.run_in_executor(None, super().start_election)
+            return None
+        return super().start_election(wait)
+
+    def start_game(self):
+        if _in_loop(self.loop):
+            self.loop.run_in_executor(None, super().start_game)
+            return
+        super().start_game()
+
+    def subscribe_to_leader(self):
+        self.loop.call_soon_threadsafe(self._subscribe_to_leader)
+
+    def _subscribe_to_leader(self):
+        if self.subscription is not None:
+            if self.subscription_leader_id == self.leader_id and not self.subscription.done():
+                return
+            self.subscription.cancel()
+        self.watch(self.leader_id)
+        self.subscription = self.channels.spawn(self._receive_events_async(self.leader_id))
+        self.subscription_leader_id = self.leader_id
+
+    async def _receive_events_async(self, leader_id):
+        request = tictactoe_pb2.SubscribeRequest(node_id=self.id, heartbeat_interval=self.heartbeat_interval)
+        backoff = self.resubscribe_backoff[0]
+        # The stream has its own channel, closed with the subscription
+        async with grpc.aio.insecure_channel(self.get_node_ip(leader_id), options=CHANNEL_OPTIONS) as channel:
+            stub = tictactoe_pb2_grpc.GameMasterStub(self.stub_channel(channel))
+            # Opened again until the task is cancelled or another leader is elected,
+            # until then the leader falls back to unary calls
+            while self.leader_id == leader_id:
+                try:
+                    async for event in stub.Subscribe(request):
+                        self.handle_event(event)
+                        backoff = self.resubscribe_backoff[0]
+                except grpc.RpcError:
+                    pass
+                await asyncio.sleep(backoff)
+                backoff = min(2 * backoff, self.resubscribe_backoff[1])
@@ -0,0 +1,306 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import Counter
+from threading import Lock
+
+from game_session import GameSession
+from tic_tac_toe import *
+
+# Result of a game that nobody won on a full board, a game that was not finished has E
+DRAW = 2
+
+# game id, player x id, player o id, start of the game (seconds since the epoch), width, height, k,
+# result (X, O, DRAW or E), number of moves, moves, milliseconds each of the first 9 moves took.
+# On 3 x 3 boards the moves are the positions packed 4 bits each in the order they were made, and the
+# move times are NO_TIME past the last move. Other boards keep their moves in `<path>.moves` as
+# MOVE records and `moves` is the offset of the first one.
+RECORD = struct.Struct('<IiidHHHbHQ9H')
+MOVE = struct.Struct('<IH')  # position, milliseconds the move took
+INLINE = (3, 3, 3)
+NO_TIME = 0xFFFF
+MAX_TIME = NO_TIME - 1  # longer moves are cut to this
+# Index entry for every game id: number of the record of the game + 1, 0 for no game
+SLOT = struct.Struct('<I')
+
+# Offsets of the fields in a record
+_GAME_ID, _WIDTH, _HEIGHT, _K, _RESULT, _MOVES_NUM, _MOVES, _TIMES = 0, 20, 22, 24, 26, 27, 29, 37
+
+
+def result_of(board):
+    if board.winner is not None:
+        return board.winner
+    return DRAW if board.is_full() else E
+
+
+def _move_times(session):
+    times = []
+    previous = session.started_at
+    for moved_at in session.moves_timestamps.values():
+        times.append(min(max(round((moved_at - previous) * 1000), 0), MAX_TIME))
+        previous = moved_at
+    return times
+
+
+def _pack_positions(positions):
+    packed = 0
+    for i, pos in enumerate(positions):
+        packed |= pos << (4 * i)
+    return packed
+
+
+def _unpack_positions(packed, n):
+    return [packed >> (4 * i) & 0xF for i in range(n)]
+
+
+# Finished games, appended by the leader as they end. Records have a fixed size so the n-th game
+# starts at n * RECORD.size, and `<path>.index` holds the record of every game id.
+# A node that opens its archive starts its game ids above the ones archived. A game id that was used again
+# anyway, e.g. by another node that took over as the leader with its own archive, points to the last game.
+class GameArchive:
+    def __init__(self, path):
+        self.path = path
+        self.moves_path = path + '.moves'
+        self.index_path = path + '.index'
+
+        # A record that was torn by a crash is dropped, its moves are never referenced
+        with open(path, 'ab') as f:
+            size = f.tell()
+            f.truncate(size - size % RECORD.size)
+        self._file = open(path, 'ab')
+        self._moves_file = open(self.moves_path, 'ab')
+        self._count = self._file.tell() // RECORD.size
+
+        # The index may have missed the last games, so it is rebuilt from the records
+        self._index = array('I')
+        for record_num, game_id in enumerate(_column(_read(path), _GAME_ID, 'I')):
+            self._set_slot(game_id, record_num)
+        with open(self.index_path, 'wb') as f:
+            f.write(_little_endian(self._index))
+        self._index_file = open(self.index_path, 'r+b')
+        self._lock = Lock()
+
+    # 0 if no game was archived yet
+    @property
+    def last_game_id(self):
+        return max(len(self._index) - 1, 0)
+
+    def _set_slot(self, game_id, record_num):
+        if game_id >= len(self._index):
+            self._index.extend([0] * (game_id + 1 - len(self._index)))
+        self._index[game_id] = record_num + 1
+
+    def append(self, session):
+        board = session.board
+        positions = list(session.moves_timestamps)
+        times = _move_times(session)
+        with self._lock:
+            if board.variant == INLINE:
+                moves = _pack_positions(positions)
+                inline_times = times + [NO_TIME] * (9 - len(times))
+            else:
+                moves = self._moves_file.tell()
+                self._moves_file.write(b''.join(MOVE.pack(pos, t) for pos, t in zip(positions, times)))
+                self._moves_file.flush()
+                inline_times = [NO_TIME] * 9
+            self._file.write(RECORD.pack(session.game_id, session.player_x_id, session.player_o_id,
+                                         session.started_at, board.width, board.height, board.k,
+                                         result_of(board), len(positions), moves, *inline_times))
+            self._file.flush()
+
+            old_size = len(self._index)
+            self._set_slot(session.game_id, self._count)
+            self._count += 1
+            if len(self._index) > old_size:
+                self._index_file.seek(old_size * SLOT.size)
+                self._index_file.write(_little_endian(self._index[old_size:]))
+            else:
+                self._index_file.seek(session.game_id * SLOT.size)
+                self._index_file.write(SLOT.pack(self._count))
+            self._index_file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._moves_file.close()
+            self._index_file.close()
+
+
+# Reads the games that were archived before it was opened, without copying the files into memory.
+# A game is found by its id with one lookup in the index, the analytics read whole fields of all
+# the records at once.
+class ArchiveReader:
+    def __init__(self, path):
+        self._records = _map(path)
+        self._moves = _map(path + '.moves')
+        self._index = _map(path + '.index')
+        self._records_num = len(self._records) // RECORD.size
+
+    def __len__(self):
+        return self._records_num
+
+    # (game id, player x id, player o id, started at, width, height, k, result, number of moves, moves, *times)
+    def record(self, record_num):
+        if not 0 <= record_num < self._records_num:
+            raise IndexError(f'Record {record_num} out of range')
+        return RECORD.unpack_from(self._records, record_num * RECORD.size)
+
+    def find(self, game_id):
+        offset = game_id * SLOT.size
+        if game_id < 0 or offset + SLOT.size > len(self._index):
+            return None
+        (slot,) = SLOT.unpack_from(self._index, offset)
+        # The index is written after the record, a slot past the records belongs to a later game
+        if not slot or slot > self._records_num:
+            return None
+        return self.record(slot - 1)
+
+    # Positions in the order they were played with the milliseconds each move took
+    def moves(self, record):
+        width, height, k, moves_num, moves = record[4], record[5], record[6], record[8], record[9]
+        if (width, height, k) == INLINE:
+            return list(zip(_unpack_positions(moves, moves_num), record[10:10 + moves_num]))
+        return [MOVE.unpack_from(self._moves, moves + i * MOVE.size) for i in range(moves_num)]
+
+    # Rebuilds the game with its board and move timestamps
+    def replay(self, game_id):
+        record = self.find(game_id)
+        if record is None:
+            raise KeyError(f'Game {game_id} is not in the archive')
+        game_id, player_x_id, player_o_id, started_at, width, height, k = record[:7]
+        session = GameSession(game_id, player_x_id, player_o_id, (width, height, k))
+        session.started_at = moved_at = started_at
+        for pos, ms in self.moves(record):
+            session.board.set_symbol(pos, session.board.turn())
+            moved_at += ms / 1000
+            session.moves_timestamps[pos] = moved_at
+        session.over = True
+        return session
+
+    def _column(self, offset, typecode):
+        return _column(self._records, offset, typecode)
+
+    def _variants(self):
+        return zip(self._column(_WIDTH, 'H'), self._column(_HEIGHT, 'H'), self._column(_K, 'H'))
+
+    # (width, height, k) - Counter of the results: X, O, DRAW and E
+    def win_rates(self):
+        results = {}
+        for (variant, result), count in Counter(zip(self._variants(), self._column(_RESULT, 'b'))).items():
+            results.setdefault(variant, Counter())[result] = count
+        return results
+
+    # Counter of the first `plies` moves of the 3 x 3 games that went that far
+    def openings(self, plies=1):
+        mask = (1 << (4 * plies)) - 1
+        counts = Counter(moves & mask for variant, moves_num, moves
+                         in zip(self._variants(), self._column(_MOVES_NUM, 'H'), self._column(_MOVES, 'Q'))
+                         if variant == INLINE and moves_num >= plies)
+        return Counter({tuple(_unpack_positions(packed, plies)): count for packed, count in counts.items()})
+
+    # Counter of the milliseconds the moves took, by the move number of the game if `move` is given
+    def move_times(self, move=None):
+        times = Counter()
+        for i in range(9) if move is None else range(move, min(move + 1, 9)):
+            times.update(self._column(_TIMES + 2 * i, 'H'))
+        del times[NO_TIME]
+        # Moves of the other boards are only in the moves file
+        for record_num, variant in enumerate(self._variants()):
+            if variant != INLINE:
+                moves = self.moves(self.record(record_num))
+                if move is not None:
+                    moves = moves[move:move + 1]
+                times.update(ms for _, ms in moves)
+        return times
+
+    def close(self):
+        for data in (self._records, self._moves, self._index):
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+# Field at `offset` of every record, read with one slice per byte of the field
+def _column(data, offset, typecode):
+    values = array(typecode)
+    size = values.itemsize
+    count = len(data) // RECORD.size
+    column = bytearray(count * size)
+    for i in range(size):
+        column[i::size] = data[offset + i:count * RECORD.size:RECORD.size]
+    values.frombytes(bytes(column))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+# An empty file can't be mapped
+def _map(path):
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        pass
+    return b''
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return b''
+
+
+def percentile(times, p):
+    rank = sum(times.values()) * p / 100
+    seen = 0
+    for ms in sorted(times):
+        seen += times[ms]
+        if seen >= rank:
+            return ms
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints the statistics of a game archive or replays one game')
+    parser.add_argument('path')
+    parser.add_argument('--game', type=int, help='id of the game to replay')
+    parser.add_argument('--plies', type=int, default=2, help='moves of the openings to count')
+    args = parser.parse_args()
+
+    reader = ArchiveReader(args.path)
+    if args.game is not None:
+        session = reader.replay(args.game)
+        print(f'Game {session.game_id}: X {session.player_x_id}, O {session.player_o_id}, '
+              f'{"x".join(map(str, session.board.variant))}')
+        print_board(session.board, session.board.width)
+        print(format_move_timestamps(list(session.moves_timestamps.values()), list(session.moves_timestamps)))
+        return
+
+    print(f'{len(reader)} games')
+    names = {X: 'X won', O: 'O won', DRAW: 'draw', E: 'unfinished'}
+    for variant, results in sorted(reader.win_rates().items()):
+        games = sum(results.values())
+        print(f'{"x".join(map(str, variant))}: ' + ', '.join(
+            f'{names[result]} {count / games:.1%}' for result, count in sorted(results.items())))
+    print(f'Openings of {args.plies} moves:')
+    for opening, count in reader.openings(args.plies).most_common(10):
+        print(f'    {" ".join(str(pos + 1) for pos in opening)}: {count}')
+    times = reader.move_times()
+    if times:
+        print('Move times: ' + ', '.join(f'p{p} {percentile(times, p)}ms' for p in (50, 90, 99)))
+
+
+if __name__ == '__main__':
+    main()
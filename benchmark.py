@@ -0,0 +1,663 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent import futures
+
+import grpc
+
+from cluster import LocalCluster
+from node import Node
+import protos
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
+from tic_tac_toe import E, O, X, parse_variant
+import archive
+import move_log
+
+# 1-based positions, X wins on the fifth move
+SCRIPTED_GAME = [1, 4, 2, 5, 3]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def play_game(cluster, game_id):
+    session = cluster.leader.games[game_id]
+    players = {True: cluster.nodes[session.player_x_id], False: cluster.nodes[session.player_o_id]}
+    latencies = []
+    for i, pos in enumerate(SCRIPTED_GAME):
+        started = time.perf_counter()
+        if not players[i % 2 == 0].send_turn(pos, game_id):
+            raise RuntimeError(f'Move {pos} of game {game_id} was rejected')
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run_games(cluster, n_games, max_workers):
+    players = cluster.players()
+    game_ids = []
+    for i in range(n_games):
+        player_x, player_o = players[(2 * i) % len(players)], players[(2 * i + 1) % len(players)]
+        game_ids.append(cluster.leader.create_game(player_x.id, player_o.id).game_id)
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=min(n_games, max_workers)) as executor:
+        latencies = [latency for game in executor.map(lambda game_id: play_game(cluster, game_id), game_ids)
+                     for latency in game]
+    elapsed = time.perf_counter() - started
+
+    return {
+        'games': n_games,
+        'moves': len(latencies),
+        'seconds': elapsed,
+        'moves_per_s': len(latencies) / elapsed,
+        'p50_move_ms': percentile(latencies, 50) * 1000,
+        'p99_move_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+# The same scripted games, but every player sends its moves in all of its games with one SetSymbolBatch per turn
+def run_batched_games(cluster, n_games):
+    players = cluster.players()
+    sessions = []
+    for i in range(n_games):
+        player_x, player_o = players[(2 * i) % len(players)], players[(2 * i + 1) % len(players)]
+        sessions.append(cluster.leader.create_game(player_x.id, player_o.id))
+
+    latencies = []
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=len(players)) as executor:
+        for i, pos in enumerate(SCRIPTED_GAME):
+            moves = {}  # player id - moves of the turn
+            for session in sessions:
+                player_id = session.player_x_id if i % 2 == 0 else session.player_o_id
+                moves.setdefault(player_id, []).append((pos, session.game_id))
+
+            def send(player_id):
+                sent = time.perf_counter()
+                errors = cluster.nodes[player_id].send_turns(moves[player_id])
+                if errors is None or any(errors):
+                    raise RuntimeError(f'Moves of player {player_id} were rejected: {errors}')
+                return time.perf_counter() - sent
+
+            latencies.extend(executor.map(send, moves))
+    elapsed = time.perf_counter() - started
+
+    n_moves = n_games * len(SCRIPTED_GAME)
+    return {
+        'games': n_games,
+        'moves': n_moves,
+        'calls': len(latencies),
+        'seconds': elapsed,
+        'moves_per_s': n_moves / elapsed,
+        'p50_call_ms': percentile(latencies, 50) * 1000,
+        'p99_call_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+# Every player answers its turns from the perfect-play table, so all the games end in a draw.
+# On other boards than 3 x 3 the moves are suggested by the leader.
+def run_auto_games(cluster, n_games, variant=(3, 3, 3), timeout=60):
+    players = cluster.players()
+    for player in players:
+        player.auto_play = True
+    sessions = []
+    for i in range(n_games):
+        player_x, player_o = players[(2 * i) % len(players)], players[(2 * i + 1) % len(players)]
+        sessions.append(cluster.leader.create_game(player_x.id, player_o.id, variant))
+
+    started = time.perf_counter()
+    for session in sessions:
+        cluster.leader.send_message_players('THE GAME HAS STARTED', session)
+        cluster.leader.get_turn(session)
+    while any(session.game_id in cluster.leader.games for session in sessions):
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f'Auto players did not finish {n_games} games in {timeout}s')
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    moves = sum(session.board.moves for session in sessions)
+    return {
+        'games': n_games,
+        'moves': moves,
+        'seconds': elapsed,
+        'games_per_s': n_games / elapsed,
+        'moves_per_s': moves / elapsed,
+        'won': sum(1 for session in sessions if session.board.winner is not None),
+    }
+
+
+# Every player enqueues its share of the tickets with one call, the leader pairs them into games that
+# the auto players then play. Runs until every ticket is in a game or left waiting for another player.
+def run_lobby_games(cluster, n_games, variant=(3, 3, 3), timeout=60):
+    players = cluster.players()
+    for player in players:
+        player.auto_play = True
+        player.variant = variant
+    lobby = cluster.leader.lobby
+    matches = lobby.matches
+    n_tickets = 2 * n_games
+    tickets = {player: n_tickets // len(players) + (i < n_tickets % len(players)) for i, player in enumerate(players)}
+
+    # More tickets than the leader takes with one call are sent in several
+    def enqueue(player):
+        sent = time.perf_counter()
+        for start in range(0, tickets[player], cluster.leader.max_enqueue):
+            if not player.join_lobby(min(tickets[player] - start, cluster.leader.max_enqueue)):
+                raise RuntimeError(f'Player {player.id} could not join the lobby')
+        return time.perf_counter() - sent
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=len(players)) as executor:
+        latencies = list(executor.map(enqueue, players))
+    while 2 * (lobby.matches - matches) + lobby.waiting < n_tickets:
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f'The lobby did not pair {n_tickets} tickets in {timeout}s')
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'tickets': n_tickets,
+        'matches': lobby.matches - matches,
+        'seconds': elapsed,
+        'matches_per_s': (lobby.matches - matches) / elapsed,
+        'p50_enqueue_ms': percentile(latencies, 50) * 1000,
+        'p99_enqueue_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+# Times the analytics over every game the leader archived and the replay of a single game
+def read_archive(path):
+    reader = archive.ArchiveReader(path)
+    started = time.perf_counter()
+    reader.win_rates()
+    reader.openings(2)
+    times = reader.move_times()
+    scan = time.perf_counter() - started
+    started = time.perf_counter()
+    for record_num in range(len(reader)):
+        reader.replay(reader.record(record_num)[0])
+    replay = (time.perf_counter() - started) / max(len(reader), 1)
+    return {
+        'games': len(reader),
+        'bytes_per_game': os.path.getsize(path) / max(len(reader), 1),
+        'scan_ms': scan * 1000,
+        'replay_us': replay * 1e6,
+        'p50_move_ms': archive.percentile(times, 50),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Starts `n_processes` nodes with `python node.py --config` and measures how long each one takes
+# until it accepts connections, plus the import of node.py in fresh interpreters
+def run_startup(n_processes, imports=5, timeout=60):
+    root = os.path.dirname(os.path.abspath(__file__))
+    started = time.perf_counter()
+    protos.compile_protos()
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    import_ms = []
+    for _ in range(imports):
+        res = subprocess.run([sys.executable, '-c', 'import time; started = time.perf_counter(); import node; '
+                                                    'print((time.perf_counter() - started) * 1000)'],
+                             cwd=root, capture_output=True, text=True, check=True)
+        import_ms.append(float(res.stdout))
+
+    addresses = {node_id: f'127.0.0.1:{free_port()}' for node_id in range(1, n_processes + 1)}
+    with tempfile.TemporaryDirectory() as config_dir:
+        config_path = os.path.join(config_dir, 'ring.json')
+        with open(config_path, 'w') as f:
+            json.dump({'nodes': {str(node_id): address for node_id, address in addresses.items()}}, f)
+
+        processes = {}
+        started = time.perf_counter()
+        try:
+            # stdin stays open, the nodes wait for commands until they are terminated
+            for node_id in addresses:
+                processes[node_id] = subprocess.Popen(
+                    [sys.executable, 'node.py', '--config', config_path, '--id', str(node_id)],
+                    cwd=root, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+            # Polled with plain connects, a channel waits out its reconnect backoff after the first refused one
+            ready_s = {}
+            waiting = dict(addresses)
+            while waiting:
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f'Nodes {sorted(waiting)} did not start in {timeout}s')
+                for node_id, address in list(waiting.items()):
+                    host, port = address.rsplit(':', 1)
+                    try:
+                        socket.create_connection((host, int(port)), timeout=0.1).close()
+                    except OSError:
+                        continue
+                    ready_s[node_id] = time.perf_counter() - started
+                    del waiting[node_id]
+                time.sleep(0.001)
+        finally:
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                process.wait()
+
+    ready = list(ready_s.values())
+    return {
+        'processes': n_processes,
+        'compile_ms': compile_ms,
+        'import_ms': {'p50': percentile(import_ms, 50), 'min': min(import_ms)},
+        'ready_ms': {'p50': percentile(ready, 50) * 1000, 'p99': percentile(ready, 99) * 1000},
+        'all_ready_ms': max(ready) * 1000,
+    }
+
+
+# Fails a call of both players to the leader with an expired deadline and checks that their event streams
+# keep delivering the moves and heartbeats of the leader
+def check_resubscribe(cluster, timeout=5):
+    leader = cluster.leader
+    player_x, player_o = cluster.players()[:2]
+    session = leader.create_game(player_x.id, player_o.id)
+    for player in (player_x, player_o):
+        with contextlib.suppress(grpc.RpcError):
+            player.channels.call(leader.id, tictactoe_pb2_grpc.GameMasterStub, 'ListBoard',
+                                 tictactoe_pb2.ListBoardRequest(game_id=session.game_id), timeout=1e-6)
+
+    started = time.perf_counter()
+    if not player_x.send_turn(SCRIPTED_GAME[0], session.game_id):
+        raise RuntimeError('The first move was rejected')
+    while any(player.local_board(session.game_id)[SCRIPTED_GAME[0] - 1] != X for player in (player_x, player_o)):
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f'The move did not reach both players through their streams in {timeout}s')
+        time.sleep(0.001)
+    event_ms = (time.perf_counter() - started) * 1000
+    time.sleep(10 * player_x.heartbeat_interval)
+    suspected = [player.id for player in (player_x, player_o) if player.suspects(leader.id)]
+    if suspected:
+        raise RuntimeError(f'Players {suspected} suspect the leader that is up')
+
+    for i, pos in enumerate(SCRIPTED_GAME[1:], 1):
+        if not (player_x if i % 2 == 0 else player_o).send_turn(pos, session.game_id):
+            raise RuntimeError(f'Move {pos} of game {session.game_id} was rejected')
+    return {'event_ms': event_ms}
+
+
+# Calls to the leader that fail with an expired deadline, while other calls of the same player
+# to the leader are in flight on the same channel. None of the other calls may fail.
+def check_failed_calls(cluster, n_calls=200):
+    leader = cluster.leader
+    player = cluster.players()[0]
+    session = leader.create_game(player.id, cluster.players()[1].id)
+    request = tictactoe_pb2.SuggestMoveRequest(game_id=session.game_id)
+
+    def expire():
+        with contextlib.suppress(grpc.RpcError):
+            player.channels.call(leader.id, tictactoe_pb2_grpc.GameMasterStub, 'ListBoard',
+                                 tictactoe_pb2.ListBoardRequest(game_id=session.game_id), timeout=1e-6)
+
+    failures = []
+
+    def suggest():
+        try:
+            player.channels.call(leader.id, tictactoe_pb2_grpc.GameMasterStub, 'SuggestMove', request, timeout=10)
+        except grpc.RpcError as e:
+            failures.append(e.code())
+
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(n_calls):
+            executor.submit(expire)
+            executor.submit(suggest)
+    leader.end_game('Check finished', session.game_id)
+    if failures:
+        raise RuntimeError(f'{len(failures)} of {n_calls} calls failed next to expired ones: {set(failures)}')
+    return {'calls': n_calls}
+
+
+# A node on the old protos calls the services without the package, and only reads the board list
+def check_legacy_paths(cluster):
+    leader = cluster.leader
+    player_x, player_o = cluster.players()[:2]
+    session = leader.create_game(player_x.id, player_o.id)
+    leader.set_symbol(player_x.id, SCRIPTED_GAME[0] - 1, session.game_id)
+    request = tictactoe_pb2.ListBoardRequest(game_id=session.game_id)
+    with grpc.insecure_channel(leader.get_node_ip(leader.id)) as channel:
+        legacy = tictactoe_pb2_grpc.GameMasterStub(protos.LegacyChannel(channel)).ListBoard(request, timeout=10)
+        current = tictactoe_pb2_grpc.GameMasterStub(channel).ListBoard(request, timeout=10)
+    leader.end_game('Check finished', session.game_id)
+    if legacy != current:
+        raise RuntimeError('The board differs on the path without the package')
+    if legacy.board[SCRIPTED_GAME[0] - 1] != X or not legacy.timestamps[SCRIPTED_GAME[0] - 1]:
+        raise RuntimeError(f'The board list {list(legacy.board)} misses the move')
+    return {'version': legacy.version}
+
+
+# Plays scripted games through one PlayStream, alternating move batches with board listings, with an
+# unknown game in some of them. Every response has to come back in order with a result for every item.
+def check_play_stream(cluster, n_games=3):
+    leader = cluster.leader
+    player_x, player_o = cluster.players()[:2]
+    game_ids = [leader.create_game(player_x.id, player_o.id).game_id for _ in range(n_games)]
+    unknown_id = max(game_ids) + 1000
+
+    requests = []  # request, expected success of every item
+    for i, pos in enumerate(SCRIPTED_GAME):
+        player_id = player_x.id if i % 2 == 0 else player_o.id
+        moves = [tictactoe_pb2.SetSymbolRequest(node_id=player_id, position=pos - 1, game_id=game_id)
+                 for game_id in game_ids]
+        if i == 1:
+            moves.append(tictactoe_pb2.SetSymbolRequest(node_id=player_id, position=pos - 1, game_id=unknown_id))
+        requests.append((tictactoe_pb2.PlayRequest(set_symbols=tictactoe_pb2.SetSymbolBatchRequest(moves=moves)),
+                         [move.game_id != unknown_id for move in moves]))
+        # The games end with the last move
+        if i < len(SCRIPTED_GAME) - 1:
+            boards = [tictactoe_pb2.ListBoardRequest(game_id=game_id) for game_id in game_ids + [unknown_id]]
+            requests.append((tictactoe_pb2.PlayRequest(list_boards=tictactoe_pb2.ListBoardsRequest(boards=boards)),
+                             [board.game_id != unknown_id for board in boards]))
+    for request_id, (request, _) in enumerate(requests, 1):
+        request.request_id = request_id
+
+    started = time.perf_counter()
+    with grpc.insecure_channel(leader.get_node_ip(leader.id)) as channel:
+        responses = list(tictactoe_pb2_grpc.GameMasterStub(channel).PlayStream(
+            iter([request for request, _ in requests]), timeout=10))
+    elapsed = time.perf_counter() - started
+
+    if len(responses) != len(requests):
+        raise RuntimeError(f'{len(responses)} responses to {len(requests)} requests')
+    moves = {}  # game id - symbol of every position played so far
+    for (request, expected), res in zip(requests, responses):
+        kind = request.WhichOneof('action')
+        if res.request_id != request.request_id or res.WhichOneof('result') != kind:
+            raise RuntimeError(f'Response {res.request_id} ({res.WhichOneof("result")}) '
+                               f'came back for request {request.request_id} ({kind})')
+        results = getattr(res, kind).results
+        if [result.success for result in results] != expected:
+            raise RuntimeError(f'Results of request {request.request_id}: {[r.success for r in results]}, '
+                               f'expected {expected}')
+        if kind == 'set_symbols':
+            for move in request.set_symbols.moves:
+                if move.game_id != unknown_id:
+                    moves.setdefault(move.game_id, {})[move.position] = X if move.node_id == player_x.id else O
+            continue
+        for board, result in zip(request.list_boards.boards, results):
+            if result.success and any(result.board.board[pos] != symbol
+                                      for pos, symbol in moves[board.game_id].items()):
+                raise RuntimeError(f'Board of game {board.game_id} in request {request.request_id} misses moves')
+    return {'requests': len(requests), 'ms': elapsed * 1000}
+
+
+# Stops the leader in the middle of a game and measures the time from its last message
+# to the first move accepted by the next leader
+def run_failover(cluster, leader_timeout, failover_bound, timeout=60):
+    players = cluster.players()
+    for player in players:
+        player.leader_timeout = leader_timeout
+        player.failover_bound = failover_bound
+    player_x, player_o = players[0], players[1]
+    session = cluster.leader.create_game(player_x.id, player_o.id)
+    cluster.leader.get_turn(session)
+    if not (player_x.send_turn(1, session.game_id) and player_o.send_turn(5, session.game_id)):
+        raise RuntimeError('Moves before the failover were rejected')
+    # Replication does not hold up the moves, give the last record time to arrive
+    time.sleep(0.1)
+
+    cluster.leader.stop_server()
+    player_x.auto_play = player_o.auto_play = True
+    started = time.perf_counter()
+    while not (player_x.last_failover_time or player_o.last_failover_time):
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f'No move was accepted {timeout}s after the leader went down')
+        time.sleep(0.01)
+    failover = min(t for t in (player_x.last_failover_time, player_o.last_failover_time) if t)
+    return {
+        'heartbeat_interval_s': player_x.heartbeat_interval,
+        'leader_timeout_s': leader_timeout,
+        'failover_s': failover,
+        'within_bound': failover <= failover_bound,
+    }
+
+
+# Problems in a ListBoard response: the version, the timestamps and the symbols have to agree
+def board_violations(res):
+    occupied = [symbol != E for symbol in res.board]
+    violations = []
+    if sum(occupied) + 1 != res.version:
+        violations.append(f'version {res.version} with {sum(occupied)} moves')
+    if occupied != [timestamp != 0 for timestamp in res.timestamps]:
+        violations.append('timestamps do not match the moves')
+    if list(res.board).count(X) - list(res.board).count(O) not in (0, 1):
+        violations.append(f'board {list(res.board)} is not reachable')
+    return violations
+
+
+# Problems in the move log: every accepted move is logged once, the symbols alternate
+# and nothing follows the end of a game
+def log_violations(records, accepted):
+    violations = []
+    moves, ended = {}, set()
+    for kind, game_id, a, b, _ in records:
+        if game_id in ended:
+            violations.append(f'game {game_id}: record {kind} after the end')
+        elif kind == move_log.MOVE:
+            game_moves = moves.setdefault(game_id, [])
+            if b != (X if len(game_moves) % 2 == 0 else O):
+                violations.append(f'game {game_id}: symbol {b} out of turn')
+            if a in game_moves:
+                violations.append(f'game {game_id}: position {a} taken twice')
+            game_moves.append(a)
+        elif kind == move_log.GAME_END:
+            ended.add(game_id)
+    for game_id, positions in accepted.items():
+        if sorted(positions) != sorted(moves.get(game_id, [])):
+            violations.append(f'game {game_id}: accepted {positions}, logged {moves.get(game_id, [])}')
+        if game_id not in ended:
+            violations.append(f'game {game_id}: never ended')
+    return violations
+
+
+# Both players of many games send moves, most of them rejected, and read the boards at the same time
+# while the leader ends the games whose player is too slow. The boards read and the move log
+# are checked afterwards: a race between the moves and the timeouts of one game shows up there.
+def run_stress(cluster, n_games, n_calls, max_workers, player_timeout=0.5, timeout=60):
+    leader = cluster.leader
+    leader.player_timeout = player_timeout
+    players = cluster.players()
+    sessions = []
+    for i in range(n_games):
+        player_x, player_o = players[(2 * i) % len(players)], players[(2 * i + 1) % len(players)]
+        sessions.append(leader.create_game(player_x.id, player_o.id))
+    for session in sessions:
+        leader.get_turn(session)
+
+    def call(i):
+        rng = random.Random(i)
+        session = rng.choice(sessions)
+        node = cluster.nodes[rng.choice(session.player_ids())]
+        try:
+            if rng.random() < 0.5:
+                pos = rng.randrange(9)
+                res = node.channels.call(leader.id, tictactoe_pb2_grpc.GameMasterStub, 'SetSymbol',
+                                         tictactoe_pb2.SetSymbolRequest(node_id=node.id, position=pos,
+                                                                        game_id=session.game_id))
+                return session.game_id, pos if res.success else None, []
+            res = node.channels.call(leader.id, tictactoe_pb2_grpc.GameMasterStub, 'ListBoard',
+                                     tictactoe_pb2.ListBoardRequest(game_id=session.game_id))
+            return session.game_id, None, board_violations(res)
+        except grpc.RpcError:
+            # The game is over
+            return session.game_id, None, []
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(call, range(n_calls)))
+    elapsed = time.perf_counter() - started
+
+    accepted = {session.game_id: [] for session in sessions}
+    violations = []
+    for game_id, pos, board in results:
+        if pos is not None:
+            accepted[game_id].append(pos)
+        violations.extend(board)
+
+    # The games that are left end with a timeout, then the log has everything and can be read
+    while leader.games:
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f'{len(leader.games)} games did not end in {timeout}s')
+        time.sleep(0.01)
+    leader.move_log.close()
+    with open(leader.move_log.path, 'rb') as f:
+        records = move_log.decode_records(f.read())
+    violations.extend(log_violations(records, accepted))
+
+    return {
+        'games': n_games,
+        'calls': n_calls,
+        'seconds': elapsed,
+        'calls_per_s': n_calls / elapsed,
+        'accepted_moves': sum(len(positions) for positions in accepted.values()),
+        'won': sum(1 for session in sessions if session.board.winner is not None),
+        'timed_out': sum(1 for session in sessions if session.board.winner is None and not session.board.is_full()),
+        'violations': violations[:20],
+    }
+
+
+def run(n_nodes, games, node_cls, max_workers, auto=False, wal_dir=None, failover=None, heartbeat_interval=None,
+        stress=None, rpc_metrics=False, batch=False, variant=(3, 3, 3), lobby=False, archive_dir=None,
+        checks=False):
+    cluster = LocalCluster(n_nodes, node_cls)
+    if heartbeat_interval:
+        for node in cluster.nodes.values():
+            node.heartbeat_interval = heartbeat_interval
+    if wal_dir:
+        wal_path = os.path.join(wal_dir, f'leader-{n_nodes}.wal')
+        # The stress run reads the whole log afterwards
+        cluster.leader.open_move_log(wal_path, snapshot_every=10 ** 9 if stress else 10000)
+    if archive_dir:
+        archive_path = os.path.join(archive_dir, f'archive-{n_nodes}')
+        cluster.leader.open_archive(archive_path)
+    cluster.start()
+    try:
+        result = {
+            'nodes': n_nodes,
+            'election_s': cluster.elect(),
+            'clock_sync_s': cluster.sync_clocks(),
+            'clock_skew_ms': cluster.clock_skew() * 1000,
+        }
+        if stress:
+            result['stress'] = run_stress(cluster, max(games), stress, max_workers)
+        else:
+            result['runs'] = [run_lobby_games(cluster, n_games, variant) if lobby
+                              else run_auto_games(cluster, n_games, variant) if auto
+                              else run_batched_games(cluster, n_games) if batch
+                              else run_games(cluster, n_games, max_workers)
+                              for n_games in games]
+        if archive_dir:
+            result['archive'] = read_archive(archive_path)
+        if checks:
+            result['checks'] = {'resubscribe': check_resubscribe(cluster), 'play_stream': check_play_stream(cluster),
+                                'failed_calls': check_failed_calls(cluster),
+                                'legacy_paths': check_legacy_paths(cluster)}
+        # Latency by RPC as seen by the leader and by the node that started the election
+        if rpc_metrics:
+            result['metrics'] = {'leader': cluster.leader.metrics.summary(),
+                                 'initiator': cluster.nodes[cluster.ids[0]].metrics.summary()}
+        # The leader is gone afterwards, so this runs last
+        if failover:
+            result['failover'] = run_failover(cluster, *failover)
+    finally:
+        cluster.stop()
+    if wal_dir:
+        started = time.perf_counter()
+        move_log.recover(wal_path)
+        result['recover_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def write_report(report, output=None):
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs scripted games on in-process clusters and reports JSON results')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[3, 10, 50])
+    parser.add_argument('--games', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--workers', type=int, default=64, help='games played at the same time')
+    parser.add_argument('--aio', action='store_true', help='run the nodes on grpc.aio')
+    parser.add_argument('--auto', action='store_true', help='let auto players pick the moves instead of a script')
+    parser.add_argument('--variant', type=parse_variant, default=(3, 3, 3), metavar='WxHxK',
+                        help='board of the games played by the auto players, e.g. 15x15x5')
+    parser.add_argument('--batch', action='store_true',
+                        help='send the moves of every player in all of its games with one call per turn')
+    parser.add_argument('--lobby', action='store_true',
+                        help='let the players enqueue in the lobby of the leader and measure the matches per second')
+    parser.add_argument('--archive', action='store_true',
+                        help='archive the finished games of the leader and time the analytics and replays')
+    parser.add_argument('--wal', action='store_true', help='log the moves of the leader to a temporary directory')
+    parser.add_argument('--failover', action='store_true',
+                        help='stop the leader in the middle of a game and measure the failover')
+    parser.add_argument('--heartbeat-interval', type=float,
+                        help='seconds between heartbeats of the leader, the default of the nodes if not set')
+    parser.add_argument('--leader-timeout', type=float, default=30,
+                        help='seconds without a message before players without a stream suspect the leader')
+    parser.add_argument('--failover-bound', type=float, default=5,
+                        help='longest acceptable failover in seconds')
+    parser.add_argument('--stress', type=int, metavar='CALLS',
+                        help='fire this many SetSymbol and ListBoard calls at the games instead, '
+                             'with the move log on, and check the results')
+    parser.add_argument('--check', action='store_true',
+                        help='also check that the event streams survive a failed call to the leader '
+                             'and that PlayStream answers every batch in order, and that older nodes can list a board')
+    parser.add_argument('--metrics', action='store_true',
+                        help='report the count, errors and latency of every RPC of the leader and the first node')
+    parser.add_argument('--startup', type=int, metavar='PROCESSES',
+                        help='start this many nodes as separate processes instead and time until they accept calls')
+    parser.add_argument('--output', help='file to write the results to instead of stdout')
+    args = parser.parse_args()
+
+    if args.startup:
+        write_report({'startup': run_startup(args.startup)}, args.output)
+        return
+
+    node_cls = Node
+    if args.aio:
+        from aio_node import AsyncNode as node_cls
+
+    results = []
+    # The nodes print every message they get, keep only the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with tempfile.TemporaryDirectory() as wal_dir:
+            for n_nodes in args.nodes:
+                results.append(run(n_nodes, args.games, node_cls, args.workers, args.auto,
+                                   wal_dir if args.wal or args.stress else None,
+                                   (args.leader_timeout, args.failover_bound) if args.failover else None,
+                                   args.heartbeat_interval, args.stress, args.metrics, args.batch, args.variant,
+                                   args.lobby, wal_dir if args.archive else None, args.check))
+
+    report = {
+        'config': {'aio': args.aio, 'auto': args.auto, 'variant': 'x'.join(map(str, args.variant)), 'batch': args.batch, 'lobby': args.lobby, 'wal': args.wal, 'workers': args.workers, 'moves_per_game': None if args.auto else len(SCRIPTED_GAME)},
+        'timestamp': time.time(),
+        'results': results,
+    }
+    write_report(report, args.output)
+    # Streams and timer threads of the stopped nodes don't need a clean shutdown
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
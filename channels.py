@@ -0,0 +1,106 @@
+import time
+from threading import Lock
+
+import grpc
+
+from metrics import method_name
+
+# Channels are never replaced: closing one would cancel every call in flight on it, and a channel reconnects
+# on its own after a failure. The backoff between attempts is capped so that a restarted peer is reached soon.
+CHANNEL_OPTIONS = [('grpc.initial_reconnect_backoff_ms', 100), ('grpc.min_reconnect_backoff_ms', 100),
+                   ('grpc.max_reconnect_backoff_ms', 1000)]
+
+
+# Long-lived channels and stubs to the other nodes of the ring, keyed by node id
+class ChannelPool:
+    def __init__(self, node):
+        self.node = node
+        self._channels = {}
+        self._stubs = {}
+        self._lock = Lock()
+
+    def channel(self, node_id):
+        channel = self._channels.get(node_id)
+        if channel is None:
+            with self._lock:
+                channel = self._channels.get(node_id)
+                if channel is None:
+                    channel = grpc.insecure_channel(self.node.get_node_ip(node_id), options=CHANNEL_OPTIONS)
+                    self._channels[node_id] = channel
+        return channel
+
+    def stub(self, node_id, stub_cls):
+        key = (node_id, stub_cls)
+        stub = self._stubs.get(key)
+        if stub is None:
+            stub = stub_cls(self.node.stub_channel(self.channel(node_id)))
+            self._stubs[key] = stub
+        return stub
+
+    def call(self, node_id, stub_cls, method, request, timeout=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            res = getattr(self.stub(node_id, stub_cls), method)(request, timeout=timeout)
+            failed = False
+            return res
+        finally:
+            self.node.metrics.observe('client', method_name(stub_cls, method), time.perf_counter() - started, failed)
+
+    # Starts the call and records its latency once it is done
+    def future(self, node_id, stub_cls, method, request, timeout=None):
+        started = time.perf_counter()
+        call = getattr(self.stub(node_id, stub_cls), method).future(request, timeout=timeout)
+        name = method_name(stub_cls, method)
+        call.add_done_callback(lambda done: self.node.metrics.observe(
+            'client', name, time.perf_counter() - started, done.exception() is not None))
+        return call
+
+    # Sends the request to all nodes at once, each call bounded by the timeout.
+    # `request` is either one message for every node or a dict of messages by node id.
+    # Returns the responses and the errors, both by node id.
+    def broadcast(self, node_ids, stub_cls, method, request, timeout=None):
+        calls = {}
+        failures = {}
+        for node_id in node_ids:
+            req = request[node_id] if isinstance(request, dict) else request
+            try:
+                calls[node_id] = self.future(node_id, stub_cls, method, req, timeout)
+            except grpc.RpcError as e:
+                failures[node_id] = e
+
+        results = {}
+        for node_id, call in calls.items():
+            try:
+                results[node_id] = call.result()
+            except grpc.RpcError as e:
+                failures[node_id] = e
+        return results, failures
+
+    # Sends the request to the first node that accepts it without waiting for the response.
+    # A failed attempt moves on to the next node from the gRPC callback, so no thread is held meanwhile.
+    def cast_to_next_alive(self, node_ids, stub_cls, method, request, timeout=None):
+        node_ids = list(node_ids)
+
+        def attempt(i):
+            if i == len(node_ids):
+                print('None of the nodes is responding')
+                return
+            call = self.future(node_ids[i], stub_cls, method, request, timeout)
+            call.add_done_callback(lambda done: on_done(i, done))
+
+        def on_done(i, call):
+            if call.exception() is None:
+                return
+            print(f'Node {node_ids[i]} is not responding, skipping it')
+            attempt(i + 1)
+
+        attempt(0)
+
+    def close(self):
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels.clear()
+            self._stubs.clear()
+        for channel in channels:
+            channel.close()
@@ -0,0 +1,52 @@
+import time
+
+import membership
+from node import Node
+
+
+# N nodes of one ring running in the current process, each on a port picked by the OS
+class LocalCluster:
+    # 127.0.0.1 rather than localhost: resolving the name for every new channel delays the first calls by seconds
+    def __init__(self, n, node_cls=Node, host='127.0.0.1'):
+        self.ids = list(range(1, n + 1))
+        self.nodes = {}
+        for node_id in self.ids:
+            self.nodes[node_id] = node_cls(node_id, membership.ring_ids(self.ids, node_id), host, [host] * n, port=0)
+
+        addresses = {node_id: node.get_node_ip(node_id) for node_id, node in self.nodes.items()}
+        for node in self.nodes.values():
+            node.addresses.update(addresses)
+            # Games are created and finished by the caller, the cluster stays as it is in between
+            node.restart_after_game = False
+
+    def start(self):
+        for node in self.nodes.values():
+            node.start_server()
+
+    def stop(self):
+        for node in self.nodes.values():
+            node.stop_server()
+
+    @property
+    def leader(self):
+        return self.nodes[max(self.ids)]
+
+    def players(self):
+        return [node for node in self.nodes.values() if node.id != self.leader.id]
+
+    # Returns how long the ELECTION and LEADER messages took to go around the ring
+    def elect(self, initiator_id=None):
+        initiator = self.nodes[initiator_id or self.ids[0]]
+        if not initiator.start_election():
+            raise RuntimeError('Election did not finish')
+        return initiator.last_election_time
+
+    def sync_clocks(self):
+        started = time.time()
+        self.leader.sync_clocks()
+        return time.time() - started
+
+    # All the nodes read the same clock, so after a sync their offsets should be the same
+    def clock_skew(self):
+        offsets = [node.offset for node in self.nodes.values()]
+        return max(offsets) - min(offsets)
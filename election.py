@@ -1,97 +1,135 @@
-import grpc
+from threading import Lock
 
-from protos import share_id_pb2, share_id_pb2_grpc, share_leader_id_pb2, share_leader_id_pb2_grpc
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
 
 
-def get_node_ip(node, node_id):
-    return f'{node.id2ip[node_id]}:2002{node_id}'
+# `all_ids` is only kept for rings that still have nodes reading the comma-joined ids.
+# Nodes in compatibility mode keep appending to it, all the other nodes leave it empty.
+def parse_all_ids(all_ids):
+    return list(map(int, all_ids.split(',')))
 
 
-class IdSharingServicer(share_id_pb2_grpc.IdSharingServicer):
+def append_all_ids(node, all_ids):
+    if not node.election_compat:
+        return ''
+    return f'{all_ids},{node.id}' if all_ids else str(node.id)
+
+
+# Every hop acknowledges right away and forwards the message in the background,
+# so a message that is delivered twice (e.g. retried by the sender) must only be forwarded once.
+# Per initiator only the latest election id of each phase is kept.
+class ElectionLog:
+    def __init__(self):
+        self._latest = {}
+        self._lock = Lock()
+
+    def first_delivery(self, phase, initiator_id, election_id):
+        # Messages of older nodes have no election id
+        if not election_id:
+            return True
+        with self._lock:
+            if self._latest.get((phase, initiator_id), 0) >= election_id:
+                return False
+            self._latest[(phase, initiator_id)] = election_id
+            return True
+
+
+class IdSharingServicer(tictactoe_pb2_grpc.IdSharingServicer):
     def __init__(self, node):
         self.node = node
 
     def ShareId(self, request, context):
-        all_ids = list(map(int, request.all_ids.split(',')))
+        message = self.next_message(request)
+        if message:
+            self.node.forward_to_next_alive(*message)
+        return tictactoe_pb2.ShareIdResponse(success=True)
+
+    # Returns the stub class, method and request to forward to the next alive node,
+    # or None if the message was already handled
+    def next_message(self, request):
+        if request.initiator_id:
+            initiator_id, max_id = request.initiator_id, request.max_id
+        # Sent by a node that only knows `all_ids`
+        else:
+            all_ids = parse_all_ids(request.all_ids)
+            initiator_id, max_id = all_ids[0], max(all_ids)
+        if not self.node.election_log.first_delivery('election', initiator_id, request.election_id):
+            return None
+
         # ELECTION message made a full circle
-        if self.node.id in all_ids:
+        if initiator_id == self.node.id:
             print(f'Election message made a full circle and returned to {self.node.id}')
-            leader_id = max(all_ids)
-            self.node.leader_id = leader_id
-
-            # try sending LEADER message to next alive node
-            for next_node_id in self.node.ring_ids:
-                try:
-                    with grpc.insecure_channel(get_node_ip(self.node, next_node_id)) as channel:
-                        # print(f'Forwarding LEADER message to node {next_node_id}')
-
-                        stub = share_leader_id_pb2_grpc.LeaderIdSharingStub(channel)
-                        req = share_leader_id_pb2.ShareLeaderIdRequest(sender_id=self.node.id, leader_id=leader_id,
-                                                                       all_ids=','.join([str(self.node.id)]))
-                        res = stub.ShareLeaderId(req)
-                        break
-                except grpc.RpcError as e:
-                    continue
-        # try sending ELECTION message to next alive node
+            leader_id = max_id
+            self.node.set_leader(leader_id)
+
+            # send LEADER message to next alive node
+            # print(f'Forwarding LEADER message to node {next_node_id}')
+            req = tictactoe_pb2.ShareLeaderIdRequest(sender_id=self.node.id, leader_id=leader_id,
+                                                     all_ids=append_all_ids(self.node, ''),
+                                                     initiator_id=self.node.id, alive_count=1,
+                                                     leader_seen=leader_id == self.node.id,
+                                                     election_id=request.election_id)
+            return tictactoe_pb2_grpc.LeaderIdSharingStub, 'ShareLeaderId', req
+        # send ELECTION message to next alive node
         else:
-            for next_node_id in self.node.ring_ids:
-                try:
-                    with grpc.insecure_channel(get_node_ip(self.node, next_node_id)) as channel:
-                        # print(f'Forwarding ELECTION message to node {next_node_id}')
-
-                        stub = share_id_pb2_grpc.IdSharingStub(channel)
-                        req = share_id_pb2.ShareIdRequest(sender_id=self.node.id,
-                                                          all_ids=','.join(list(map(str, all_ids + [self.node.id]))))
-                        res = stub.ShareId(req)
+            # print(f'Forwarding ELECTION message to node {next_node_id}')
+            req = tictactoe_pb2.ShareIdRequest(sender_id=self.node.id,
+                                               all_ids=append_all_ids(self.node, request.all_ids),
+                                               initiator_id=initiator_id, max_id=max(max_id, self.node.id),
+                                               election_id=request.election_id)
+            return tictactoe_pb2_grpc.IdSharingStub, 'ShareId', req
 
-                        break
-                except grpc.RpcError as e:
-                    continue
-        return share_id_pb2.ShareIdResponse(success=True)
 
-
-class LeaderIdSharingServicer(share_leader_id_pb2_grpc.LeaderIdSharingServicer):
+class LeaderIdSharingServicer(tictactoe_pb2_grpc.LeaderIdSharingServicer):
     def __init__(self, node):
         self.node = node
 
     def ShareLeaderId(self, request, context):
-        all_ids = list(map(int, request.all_ids.split(',')))
+        message = self.next_message(request)
+        if message:
+            self.node.forward_to_next_alive(*message)
+        return tictactoe_pb2.ShareLeaderIdResponse(success=True)
+
+    # Returns the stub class, method and request to forward to the next alive node,
+    # or None once the LEADER message made a full circle or was already handled
+    def next_message(self, request):
+        if request.initiator_id:
+            initiator_id, alive_count, leader_seen = request.initiator_id, request.alive_count, request.leader_seen
+        # Sent by a node that only knows `all_ids`
+        else:
+            ids = parse_all_ids(request.all_ids)
+            initiator_id, alive_count, leader_seen = ids[0], len(ids), request.leader_id in ids
+        if not self.node.election_log.first_delivery('leader', initiator_id, request.election_id):
+            return None
         # print(f'Node {self.node.id}  received LEADER message from {request.sender_id}')
 
-        if self.node.id in all_ids:
-            self.node.alive_ids = all_ids
-            if request.leader_id in all_ids:
+        if initiator_id == self.node.id:
+            self.node.alive_count = alive_count
+            if leader_seen:
                 print(f'ELECTION SUCCESSFUL! NEW LEADER ID IS {request.leader_id}',  end='\n> ')
-                self.node.leader_id = request.leader_id
+                self.node.set_leader(request.leader_id)
+                self.node.election_finished()
             # Start election all over again
             else:
                 print('starting election again')
-                self.node.start_election()
-
-        else:
-            # print(f'Node {self.node.id} sets it leader as {request.leader_id}')
-            self.node.leader_id = request.leader_id
+                self.node.start_election(wait=False)
+            return None
 
-            for next_node_id in self.node.ring_ids:
-                try:
-                    with grpc.insecure_channel(get_node_ip(self.node, next_node_id)) as channel:
-                        # print(f'Forwarding LEADER message to node {next_node_id}')
-                        stub = share_leader_id_pb2_grpc.LeaderIdSharingStub(channel)
-                        req = share_leader_id_pb2.ShareLeaderIdRequest(sender_id=self.node.id, leader_id=request.leader_id,
-                                                                       all_ids=','.join(list(map(str, all_ids + [self.node.id]))))
+        # print(f'Node {self.node.id} sets it leader as {request.leader_id}')
+        self.node.set_leader(request.leader_id)
 
-                        res = stub.ShareLeaderId(req)
-                        break
-
-                except grpc.RpcError as e:
-                    continue
-        return share_leader_id_pb2.ShareLeaderIdResponse(success=True)
+        # print(f'Forwarding LEADER message to node {next_node_id}')
+        req = tictactoe_pb2.ShareLeaderIdRequest(sender_id=self.node.id, leader_id=request.leader_id,
+                                                 all_ids=append_all_ids(self.node, request.all_ids),
+                                                 initiator_id=initiator_id, alive_count=alive_count + 1,
+                                                 leader_seen=leader_seen or request.leader_id == self.node.id,
+                                                 election_id=request.election_id)
+        return tictactoe_pb2_grpc.LeaderIdSharingStub, 'ShareLeaderId', req
 
     def NotifyLeader(self, request, context):
         print('I am the leader node.',  end='\n> ')
-        self.node.sync_clocks()
-        self.node.setup_game_data_and_request_the_first_move()
-        return share_leader_id_pb2.NotifyLeaderResponse(success=True)
-
-
-
+        # The game starts right away, the clocks are synced in the background
+        self.node.start_clock_sync()
+        self.node.setup_game_data_and_request_the_first_move(
+            (request.width, request.height, request.k) if request.width else None)
+        return tictactoe_pb2.NotifyLeaderResponse(success=True)
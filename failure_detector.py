@@ -0,0 +1,48 @@
+import math
+import time
+from collections import deque
+
+
+# Phi accrual failure detector (Hayashibara et al.): instead of a yes/no timeout it tells how
+# unlikely it is that the next heartbeat is merely late, given the intervals seen so far.
+# phi = 1 means a 10% chance that the node is still alive, phi = 8 about 1 in 10^8.
+# A pause of the sender up to `acceptable_pause` (2.5 intervals by default, e.g. a GC pause or a slow fsync)
+# is not counted, with a 0.2s interval phi reaches 8 about a second after the last heartbeat.
+class PhiAccrualDetector:
+    def __init__(self, expected_interval, window=100, min_std=None, acceptable_pause=None):
+        self.window = window
+        self.min_std = expected_interval / 4 if min_std is None else min_std
+        self.acceptable_pause = expected_interval * 2.5 if acceptable_pause is None else acceptable_pause
+        self._intervals = deque()
+        self._sum = 0.0
+        self._squares = 0.0
+        # Until the first heartbeats arrive the intervals are assumed to be around the expected one
+        self._add(expected_interval - expected_interval / 4)
+        self._add(expected_interval + expected_interval / 4)
+        self.last_heartbeat = time.monotonic()
+
+    def _add(self, interval):
+        self._intervals.append(interval)
+        self._sum += interval
+        self._squares += interval * interval
+        if len(self._intervals) > self.window:
+            dropped = self._intervals.popleft()
+            self._sum -= dropped
+            self._squares -= dropped * dropped
+
+    def heartbeat(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._add(now - self.last_heartbeat)
+        self.last_heartbeat = now
+
+    def phi(self, now=None):
+        now = time.monotonic() if now is None else now
+        n = len(self._intervals)
+        mean = self._sum / n
+        std = max(math.sqrt(max(self._squares / n - mean * mean, 0.0)), self.min_std)
+        # Logistic approximation of the normal distribution
+        y = (now - self.last_heartbeat - mean - self.acceptable_pause) / std
+        e = math.exp(min(-y * (1.5976 + 0.070566 * y * y), 700))
+        if y > 0:
+            return -math.log10(e / (1 + e)) if e > 0 else math.inf
+        return -math.log10(1 - 1 / (1 + e))
@@ -0,0 +1,43 @@
+import time
+from threading import RLock
+
+from tic_tac_toe import *
+
+
+# State of a single game hosted by the leader/GameMaster.
+# Moves, timeouts and reads of one game hold its lock, different games never wait for each other.
+class GameSession:
+    def __init__(self, game_id, player_x_id, player_o_id, variant=(3, 3, 3), started_at=None):
+        self.lock = RLock()
+        self.over = False  # set under the lock by whoever ends the game, later moves are rejected
+        self.game_id = game_id
+        self.player_x_id = player_x_id
+        self.player_o_id = player_o_id
+        # Seconds since the epoch on the clock of the moves, logged with the start of the game
+        self.started_at = time.time() if started_at is None else started_at
+        self.board = Bitboard(*variant)  # width, height and k
+        self.moves_timestamps = {}  # board index - when the move was made, seconds since the epoch
+        self.snapshot = None  # last ListBoardResponse, reused until the next move
+
+        # State for the timer
+        self.waiting_for_move = False
+        self.curr_move_timer = None
+        # Increased with every turn request, a timer of an earlier turn that fires late is ignored
+        self.turn_generation = 0
+
+    # Increases with every move, the same on every leader that replays the game
+    @property
+    def version(self):
+        return self.board.moves + 1
+
+    def player_ids(self):
+        return [self.player_x_id, self.player_o_id]
+
+    def player_id_for(self, symbol):
+        return self.player_x_id if symbol == X else self.player_o_id
+
+    def stop_waiting(self):
+        self.waiting_for_move = False
+        if self.curr_move_timer:
+            self.curr_move_timer.cancel()
+            self.curr_move_timer = None
@@ -1,37 +1,75 @@
 import grpc
 
-from protos import gamemaster_pb2, gamemaster_pb2_grpc
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
 
 
-class GameMasterServicer(gamemaster_pb2_grpc.GameMasterServicer):
+class GameMasterServicer(tictactoe_pb2_grpc.GameMasterServicer):
     def __init__(self, node):
         self.node = node
 
     def SetSymbol(self, request, context):
         try:
-            self.node.set_symbol(request.node_id, request.position)
-            if self.node.waiting_for_move:
-                self.node.waiting_for_move = False
-                self.node.curr_move_timer.cancel()
-                self.node.curr_move_timer = None
-            return gamemaster_pb2.SetSymbolResponse(success=True)
+            self.node.set_symbol(request.node_id, request.position, request.game_id)
+            return tictactoe_pb2.SetSymbolResponse(success=True)
         except Exception as exc:
-            return gamemaster_pb2.SetSymbolResponse(success=False, error=exc.args[0])
+            return tictactoe_pb2.SetSymbolResponse(success=False, error=exc.args[0])
 
     def ListBoard(self, request, context):
-        board = self.node.get_board()
-        move_timestamps = self.node.get_move_timestamps()
-        return gamemaster_pb2.ListBoardResponse(
-            board=board,
-            move_timestamps=GameMasterServicer.move_timestamps_to_str(move_timestamps)
-        )
-
-    @staticmethod
-    def move_timestamps_to_str(move_timestamps):
-        move_timestamps_str = ""
-        for i in range(9):
-            if i in move_timestamps:
-                move_timestamps_str += f"{i}: {move_timestamps[i].strftime('%H:%M:%S %m/%d/%Y')}\n"
-            else:
-                move_timestamps_str += f"{i}: None\n"
-        return move_timestamps_str
+        return self.node.list_board_snapshot(request.game_id, request.if_changed_since)
+
+    def SetSymbolBatch(self, request, context):
+        return self.set_symbol_batch(request)
+
+    def ListBoards(self, request, context):
+        return self.list_boards(request)
+
+    def PlayStream(self, request_iterator, context):
+        for request in request_iterator:
+            yield self.play(request)
+
+    def set_symbol_batch(self, request):
+        errors = self.node.set_symbols([(move.node_id, move.position, move.game_id) for move in request.moves])
+        return tictactoe_pb2.SetSymbolBatchResponse(
+            results=[tictactoe_pb2.SetSymbolResponse(success=error is None, error=error or '') for error in errors])
+
+    def list_boards(self, request):
+        results = []
+        for board in request.boards:
+            try:
+                results.append(tictactoe_pb2.ListBoardResult(
+                    success=True, board=self.node.list_board_snapshot(board.game_id, board.if_changed_since)))
+            except Exception as exc:
+                results.append(tictactoe_pb2.ListBoardResult(success=False, error=exc.args[0]))
+        return tictactoe_pb2.ListBoardsResponse(results=results)
+
+    def play(self, request):
+        if request.HasField('set_symbols'):
+            return tictactoe_pb2.PlayResponse(request_id=request.request_id,
+                                              set_symbols=self.set_symbol_batch(request.set_symbols))
+        return tictactoe_pb2.PlayResponse(request_id=request.request_id,
+                                          list_boards=self.list_boards(request.list_boards))
+
+    def Enqueue(self, request, context):
+        try:
+            variant = (request.width, request.height, request.k) if request.width else (3, 3, 3)
+            self.node.enqueue(request.node_id, variant, request.count or 1)
+            return tictactoe_pb2.EnqueueResponse(success=True)
+        except Exception as exc:
+            return tictactoe_pb2.EnqueueResponse(success=False, error=exc.args[0])
+
+    def Subscribe(self, request, context):
+        subscriber = self.node.events.subscribe(request.node_id)
+        context.add_callback(lambda: self.node.events.unsubscribe(request.node_id, subscriber))
+        interval = request.heartbeat_interval or self.node.heartbeat_interval
+        heartbeat = tictactoe_pb2.GameEvent(type=tictactoe_pb2.GameEvent.HEARTBEAT)
+        # Every event tells the player that the leader is alive, heartbeats fill the gaps
+        while context.is_active():
+            event = subscriber.get(timeout=interval)
+            yield heartbeat if event is None else event
+
+    def SuggestMove(self, request, context):
+        try:
+            position, value = self.node.suggest_move(request.game_id)
+            return tictactoe_pb2.SuggestMoveResponse(success=True, position=position, value=value)
+        except Exception as exc:
+            return tictactoe_pb2.SuggestMoveResponse(success=False, error=exc.args[0])
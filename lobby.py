@@ -0,0 +1,77 @@
+import random
+from collections import deque
+from threading import Condition, Thread, current_thread
+
+
+# Players waiting for a game on the leader. One matcher thread pairs them: everything enqueued while
+# it was busy is paired in its next batch, and the games of a batch share one fsync of the move log.
+# The players learn about their game from the usual start message, no election or clock sync is needed.
+# A player can wait for several games at once, it is never paired with itself.
+class Lobby:
+    def __init__(self, node):
+        self.node = node
+        self.matches = 0
+        self._pending = []  # (variant, player id) enqueued since the last batch
+        self._waiting = {}  # variant - tickets of a single player left over from the last batches
+        self._closed = False
+        self._cond = Condition()
+        self._matcher = None
+
+    @property
+    def running(self):
+        return self._matcher is not None
+
+    # Tickets that were paired with nothing yet
+    @property
+    def waiting(self):
+        return sum(len(waiting) for waiting in list(self._waiting.values()))
+
+    def enqueue(self, player_id, variant=(3, 3, 3), count=1):
+        with self._cond:
+            if self._closed:
+                raise Exception('The lobby is closed.')
+            if self._matcher is None:
+                self._matcher = Thread(target=self._run, daemon=True)
+                self._matcher.start()
+            self._pending.extend([(variant, player_id)] * count)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if self._closed:
+                    return
+                tickets, self._pending = self._pending, []
+            self._start_games(self._pair(tickets))
+
+    # Pairs every ticket with the earliest waiting ticket of another player
+    def _pair(self, tickets):
+        pairs = []
+        for variant, player_id in tickets:
+            waiting = self._waiting.setdefault(variant, deque())
+            if waiting and waiting[0] != player_id:
+                pair = [waiting.popleft(), player_id]
+                random.shuffle(pair)
+                pairs.append((variant, *pair))
+            else:
+                waiting.append(player_id)
+        return pairs
+
+    def _start_games(self, pairs):
+        sessions = [self.node.create_game(player_x_id, player_o_id, variant, wait=False)
+                    for variant, player_x_id, player_o_id in pairs]
+        if self.node.move_log:
+            self.node.move_log.sync()
+        for session in sessions:
+            self.node.send_message_players('THE GAME HAS STARTED', session)
+            self.node.get_turn(session)
+        self.matches += len(sessions)
+
+    # With `wait` the batch in flight is finished first, so the channels can be closed afterwards
+    def close(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait and self._matcher is not None and self._matcher is not current_thread():
+            self._matcher.join()
@@ -0,0 +1,23 @@
+import json
+
+
+# Reads the nodes of the ring from a JSON file: {"nodes": {"<id>": "<host>:<port>", ...}}
+def load(path):
+    with open(path) as f:
+        config = json.load(f)
+    return {int(node_id): address for node_id, address in config['nodes'].items()}
+
+
+# Ids in the order of the ring as seen from `node_id`: the nodes after it, then the ones before it, itself last
+def ring_ids(node_ids, node_id):
+    node_ids = sorted(node_ids)
+    i = node_ids.index(node_id)
+    return node_ids[i + 1:] + node_ids[:i + 1]
+
+
+def create_node(node_cls, node_id, addresses):
+    if node_id not in addresses:
+        raise ValueError(f'Node {node_id} is not in the config')
+    ids = ring_ids(addresses, node_id)
+    hosts = [addresses[i].rsplit(':', 1)[0] for i in ids]
+    return node_cls(node_id, ids, hosts[-1], hosts, addresses=addresses)
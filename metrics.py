@@ -0,0 +1,206 @@
+import asyncio
+import time
+from threading import Lock, Thread
+
+import grpc
+
+from protos import PACKAGE
+
+# Upper bounds of the latency buckets in seconds, from a local call to a call that times out
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+
+    def observe(self, seconds, failed):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.errors += failed
+        self.sum += seconds
+
+    # Upper bound of the bucket the p-th percentile falls in
+    def percentile(self, p):
+        rank = self.count * p / 100
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+# Name of a method called through a stub, as the server sees it
+def method_name(stub_cls, method):
+    return f'/{PACKAGE}.{stub_cls.__name__[:-len("Stub")]}/{method}'
+
+
+# Count, errors and latency of every RPC method, for the calls served by the node ('server')
+# and the calls it makes to other nodes ('client'). Methods are named like
+# '/tictactoe.v1.GameMaster/SetSymbol'.
+class Metrics:
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self._histograms = {}  # (side, method) - Histogram
+        self._lock = Lock()
+
+    def observe(self, side, method, seconds, failed=False):
+        with self._lock:
+            histogram = self._histograms.get((side, method))
+            if histogram is None:
+                histogram = self._histograms[(side, method)] = Histogram()
+            histogram.observe(seconds, failed)
+
+    # side - method - count, errors, mean and percentiles in milliseconds
+    def summary(self):
+        with self._lock:
+            result = {}
+            for (side, method), h in sorted(self._histograms.items()):
+                result.setdefault(side, {})[method] = {
+                    'count': h.count,
+                    'errors': h.errors,
+                    'mean_ms': h.sum / h.count * 1000,
+                    'p50_ms': h.percentile(50) * 1000,
+                    'p99_ms': h.percentile(99) * 1000,
+                }
+            return result
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = ['# HELP tictactoe_rpc_seconds Latency of the RPCs served and made by the node',
+                 '# TYPE tictactoe_rpc_seconds histogram']
+        errors = ['# HELP tictactoe_rpc_errors_total RPCs that failed',
+                  '# TYPE tictactoe_rpc_errors_total counter']
+        with self._lock:
+            for (side, method), h in sorted(self._histograms.items()):
+                labels = f'node="{self.node_id}",side="{side}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'tictactoe_rpc_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'tictactoe_rpc_seconds_sum{{{labels}}} {h.sum}')
+                lines.append(f'tictactoe_rpc_seconds_count{{{labels}}} {h.count}')
+                errors.append(f'tictactoe_rpc_errors_total{{{labels}}} {h.errors}')
+        return '\n'.join(lines + errors) + '\n'
+
+
+def _handler_factory(handler):
+    if handler.unary_unary:
+        return grpc.unary_unary_rpc_method_handler, handler.unary_unary
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler, handler.unary_stream
+    if handler.stream_unary:
+        return grpc.stream_unary_rpc_method_handler, handler.stream_unary
+    return grpc.stream_stream_rpc_method_handler, handler.stream_stream
+
+
+# Records every call served by a grpc.server. Streams are timed until they end,
+# a stream closed by the client does not count as an error.
+class ServerInterceptor(grpc.ServerInterceptor):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method
+        factory, behavior = _handler_factory(handler)
+
+        def unary(request, context):
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = behavior(request, context)
+                failed = False
+                return response
+            finally:
+                self.metrics.observe('server', method, time.perf_counter() - started, failed)
+
+        def stream(request, context):
+            started = time.perf_counter()
+            failed = True
+            try:
+                yield from behavior(request, context)
+                failed = False
+            except GeneratorExit:
+                failed = False
+                raise
+            finally:
+                self.metrics.observe('server', method, time.perf_counter() - started, failed)
+
+        return factory(stream if handler.response_streaming else unary,
+                       request_deserializer=handler.request_deserializer,
+                       response_serializer=handler.response_serializer)
+
+
+# ServerInterceptor for grpc.aio servers, whose handlers are coroutines and async generators
+class AioServerInterceptor(grpc.aio.ServerInterceptor):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method
+        factory, behavior = _handler_factory(handler)
+
+        async def unary(request, context):
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = await behavior(request, context)
+                failed = False
+                return response
+            finally:
+                self.metrics.observe('server', method, time.perf_counter() - started, failed)
+
+        async def stream(request, context):
+            started = time.perf_counter()
+            failed = True
+            try:
+                async for response in behavior(request, context):
+                    yield response
+                failed = False
+            except (GeneratorExit, asyncio.CancelledError):
+                failed = False
+                raise
+            finally:
+                self.metrics.observe('server', method, time.perf_counter() - started, failed)
+
+        return factory(stream if handler.response_streaming else unary,
+                       request_deserializer=handler.request_deserializer,
+                       response_serializer=handler.response_serializer)
+
+
+# Serves Metrics.render on http://host:port/metrics from a daemon thread, returns the server
+def serve(metrics, port, host=''):
+    # Only nodes that export their metrics pay for importing the http server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
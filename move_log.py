@@ -0,0 +1,211 @@
+import os
+import struct
+import zlib
+from threading import Condition, Thread
+
+from game_session import GameSession
+from tic_tac_toe import *
+
+GAME_START = 1
+MOVE = 2
+GAME_END = 3
+# Follows GAME_START for boards other than 3 x 3
+VARIANT = 4
+# First record of a snapshot: the largest game id ever started, the finished games are not in the snapshot
+LAST_GAME_ID = 5
+
+# type, game id, player x id and player o id (GAME_START), position and symbol (MOVE)
+# or width << 16 | height and k (VARIANT), timestamp (LAST_GAME_ID only has the game id);
+# followed by the crc32 of these fields to find a torn write at the end of the log
+RECORD = struct.Struct('<BIIid')
+CRC = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CRC.size
+
+
+def encode_record(kind, game_id, a=0, b=0, timestamp=0.0):
+    body = RECORD.pack(kind, game_id, a, b, timestamp)
+    return body + CRC.pack(zlib.crc32(body))
+
+
+# Returns the records up to the first one that was not written completely
+def decode_records(data):
+    records = []
+    for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        (crc,) = CRC.unpack_from(data, offset + RECORD.size)
+        if zlib.crc32(data[offset:offset + RECORD.size]) != crc:
+            break
+        records.append(RECORD.unpack_from(data, offset))
+    return records
+
+
+def variant_fields(variant):
+    width, height, k = variant
+    return width << 16 | height, k
+
+
+def session_records(session):
+    records = [encode_record(GAME_START, session.game_id, session.player_x_id, session.player_o_id,
+                             session.started_at)]
+    if session.board.variant != (3, 3, 3):
+        records.append(encode_record(VARIANT, session.game_id, *variant_fields(session.board.variant)))
+    # Moves are kept in the order they were made
+    for pos, moved_at in list(session.moves_timestamps.items()):
+        records.append(encode_record(MOVE, session.game_id, pos, session.board[pos], moved_at))
+    return records
+
+
+# A record can be applied more than once: the snapshot may already contain a move
+# that is logged again right after it was taken
+def apply_record(sessions, record):
+    kind, game_id, a, b, timestamp = record
+    if kind == GAME_START:
+        session = sessions.setdefault(game_id, GameSession(game_id, a, b))
+        # Logs of older versions have no start time
+        if timestamp:
+            session.started_at = timestamp
+    elif kind == VARIANT:
+        session = sessions.get(game_id)
+        if session is not None and not session.board.moves:
+            session.board = Bitboard(a >> 16, a & 0xFFFF, b)
+    elif kind == MOVE:
+        session = sessions.get(game_id)
+        if session is None or session.board[a] != E:
+            return
+        session.board.set_symbol(a, b)
+        session.moves_timestamps[a] = timestamp
+    elif kind == GAME_END:
+        sessions.pop(game_id, None)
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return b''
+
+
+# Returns the games that were still in progress: game id - GameSession
+def recover(path):
+    sessions = {}
+    for data in (_read(path + '.snapshot'), _read(path)):
+        for record in decode_records(data):
+            apply_record(sessions, record)
+    return sessions
+
+
+# Returns the largest game id that was started, so that it is not used again after a restart
+def last_game_id(path):
+    last_id = 0
+    for data in (_read(path + '.snapshot'), _read(path)):
+        for kind, game_id, *_ in decode_records(data):
+            if kind in (GAME_START, LAST_GAME_ID):
+                last_id = max(last_id, game_id)
+    return last_id
+
+
+# Append-only log of the games hosted by the leader.
+# Records are written and fsynced by one thread: everything appended while the previous fsync
+# was running goes to disk with the next one, so concurrent moves share a single fsync.
+# Every `snapshot_every` records the games in progress are written to `<path>.snapshot` and the log starts over.
+class MoveLog:
+    def __init__(self, path, snapshot_source, snapshot_every=10000):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.snapshot_source = snapshot_source  # returns the sessions to write to the snapshot
+        self.snapshot_every = snapshot_every
+
+        # A record that was torn by a crash is dropped, the next ones are appended after the last complete one
+        with open(path, 'ab') as f:
+            f.truncate(len(decode_records(_read(path))) * RECORD_SIZE)
+        self._file = open(path, 'ab')
+        self.last_game_id = last_game_id(path)
+        self._buffer = []
+        self._appended = 0  # sequence number of the last appended record
+        self._flushed = 0  # sequence number of the last record on disk
+        self._since_snapshot = 0
+        self._closed = False
+        self._cond = Condition()
+        self._flusher = Thread(target=self._run, daemon=True)
+        self._flusher.start()
+
+    # Returns the sequence number to wait for
+    def append(self, kind, game_id, a=0, b=0, timestamp=0.0):
+        record = encode_record(kind, game_id, a, b, timestamp)
+        with self._cond:
+            if self._closed:
+                raise ValueError('Move log is closed')
+            self._buffer.append(record)
+            self._appended += 1
+            if kind == GAME_START:
+                self.last_game_id = max(self.last_game_id, game_id)
+            self._cond.notify_all()
+            return self._appended
+
+    def wait(self, seq):
+        with self._cond:
+            self._cond.wait_for(lambda: self._flushed >= seq or self._closed)
+
+    def log(self, kind, game_id, a=0, b=0, timestamp=0.0):
+        self.wait(self.append(kind, game_id, a, b, timestamp))
+
+    # Returns once everything appended so far is on disk
+    def sync(self):
+        with self._cond:
+            seq = self._appended
+        self.wait(seq)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+                if not self._buffer:
+                    return
+                records, self._buffer = self._buffer, []
+                seq = self._appended
+            self._file.write(b''.join(records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            with self._cond:
+                self._flushed = seq
+                self._since_snapshot += len(records)
+                self._cond.notify_all()
+            if self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+
+    def _snapshot(self):
+        # Appends wait until the log starts over, records that are still buffered
+        # belong to moves that are already part of the snapshot
+        with self._cond:
+            data = encode_record(LAST_GAME_ID, self.last_game_id) + b''.join(
+                record for session in self.snapshot_source() for record in session_records(session))
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            _fsync_dir(self.snapshot_path)
+
+            self._file.close()
+            self._file = open(self.path, 'wb')
+            os.fsync(self._file.fileno())
+            self._buffer = []
+            self._flushed = self._appended
+            self._since_snapshot = 0
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._file.close()
+
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,8 +1,8 @@
+import argparse
 import random
-import sys
 import itertools
 from concurrent import futures
-from threading import Timer
+from threading import Event, Lock, Thread
 
 import grpc
 
@@ -10,16 +10,26 @@ import time
 import datetime
 import os
 
-from protos import share_id_pb2, share_id_pb2_grpc, share_leader_id_pb2, share_leader_id_pb2_grpc, \
-    gamemaster_pb2, gamemaster_pb2_grpc, player_pb2, player_pb2_grpc, \
-    time_sync_pb2, time_sync_pb2_grpc, set_timeout_pb2, set_timeout_pb2_grpc
-from election import IdSharingServicer, LeaderIdSharingServicer
+from protos import LegacyChannel, LegacyPaths, tictactoe_pb2, tictactoe_pb2_grpc
+from election import ElectionLog, IdSharingServicer, LeaderIdSharingServicer, append_all_ids
 from gamemaster import GameMasterServicer
 from player import PlayerServicer
 from set_timeout import TimeOutServicer
+from channels import CHANNEL_OPTIONS, ChannelPool
+from game_session import GameSession
+from subscriptions import EventHub
+from timer_wheel import TimerWheel
+import move_log
+from archive import GameArchive
+from replication import Replicator
+from lobby import Lobby
+from failure_detector import PhiAccrualDetector
+import membership
+import metrics
 
 from tic_tac_toe import *
 
+import solver
 import time_sync
 
 
@@ -27,89 +37,220 @@ DEBUGGING = False
 
 
 class Node:
-    def __init__(self, id, ring_ids, ip=None, ring_ips=None):
+    def __init__(self, id, ring_ids, ip=None, ring_ips=None, port=None, addresses=None):
         self.id = id
         self.ip = ip
         self.ring_ids = ring_ids
         self.ring_ips = ring_ips
         self.id2ip = {k:v for k,v in zip(ring_ids, ring_ips)}
-        self.alive_ids = ring_ids
+        # node id - 'host:port' for nodes that don't listen on the default port
+        # (e.g. read from a config file, or port 0 is picked by the OS)
+        self.addresses = dict(addresses or {})
+        self.port = port
+        # Alive nodes counted by the LEADER message of the last election
+        self.alive_count = len(ring_ids)
+        # A game needs the leader and two players
+        self.min_players = 2
+        # Width, height and k in a row of the games started by this node
+        self.variant = (3, 3, 3)
         self.leader_id = None
+        # Keep writing the comma-joined ids of the election messages while older nodes are in the ring
+        self.election_compat = False
+        # Call the other nodes on the paths without the package, which nodes of every version serve
+        self.legacy_paths = False
+        self.election_log = ElectionLog()
+        self.election_id = 0
+        self.election_done = Event()
+        self.election_timeout = 10
+        self.last_election_time = None
 
         # For clock synchronization
         self.offset = 0
+        self.clock_sync_samples = 8  # exchanges with every node, only the faster half is used
+        self.clock_sync_interval = 60  # seconds between two syncs while this node is the leader
+        self.clock_sync_timer = None
 
         # Leader/GameMaster (only defined for a leader)
-        self.player_x_id = None
-        self.player_o_id = None
-        self.board = None
-        self.moves_timestamps = {}  # board index - when the move was made
+        self.games = {}  # game id - GameSession
+        self.game_ids = itertools.count(1)
+        # Write-ahead log of the hosted games and the games found in it that were not resumed yet
+        self.move_log = None
+        # Finished games of this node as the leader
+        self.archive = None
+        self.recovered_games = {}
+        # The leader sends the records of its move log to the `replicas` nodes that are elected after it,
+        # they keep the games in `replica_games` and resume them if they become the leader
+        self.replication = True
+        self.replicas = 2
+        self.replicator = Replicator(self)
+        self.replica_games = {}
+        # Players waiting for a game, paired into new games without an election
+        self.lobby = Lobby(self)
+        self.max_enqueue = 1000  # games a player can wait for with one Enqueue call
+
+        # Players streaming game events from this node while it is the leader
+        self.events = EventHub()
+
+        # Player: the game this node takes part in
+        self.game_id = None
+        self.game_players = {}  # game id - ids of both players, as sent by the leader
+        self.game_variants = {}  # game id - width, height and k of the board, as sent by the leader
+        self.boards = {}  # game id - board as seen from the events pushed by the leader
+        self.listed_boards = {}  # game id - last ListBoardResponse
+        self.subscription = None
+        self.subscription_leader_id = None
+        # Seconds before a stream that ended is opened again, doubled up to the second one while it keeps failing
+        self.resubscribe_backoff = (0.1, 2)
+        # Concurrent elections set the leader from several handlers at once
+        self.subscription_lock = Lock()
+        # Games of the lobby keep the leader after they end
+        self.lobby_joined = False
+        # Player answers every turn request with the move of the perfect-play table
+        self.auto_play = False
+        self.auto_moves = futures.ThreadPoolExecutor(max_workers=1)
+
+        # The leader sends a heartbeat through the event stream when it has nothing else to send,
+        # players suspect it once phi of its detector reaches `phi_threshold`.
+        # Without a stream they fall back to `leader_timeout`.
+        self.heartbeat_interval = 0.2
+        self.phi_threshold = 8
+        self.detectors = {}  # node id - PhiAccrualDetector
 
         # State for the timer
-        self.waiting_for_move = False
-        self.curr_move_timer = None
         self.leader_timeout = 30
         self.player_timeout = 120
+        # Whether the leader starts a new election and game once the last game it hosts is over
+        self.restart_after_game = True
+        self.rpc_timeout = 5  # deadline for every call of a broadcast
 
         self.last_res_from_leader_timestamp = None
         self.leader_timeout_timer = None
+        # Time from the last message of a leader that went down to the first move accepted by the next one
+        self.failover_bound = 60
+        self.failover_started = None
+        self.last_failover_time = None
+        # Seconds since the epoch, the simulator replaces it with its virtual clock
+        self.clock = time.time
+        # Move and leader timeouts are all driven by one timer thread
+        self.timers = self.create_timers()
 
         self.reset()
 
         self.cmds = {
             'Start-game': self.start_game,
+            'Join-lobby': self.join_lobby,
             'Set-symbol': self.send_turn,
             'List-board': self.list_board,
+            'Suggest-move': self.get_suggestion,
             'Set-node-time': self.set_node_time,
             'Set-time-out': self.set_time_out
         }
 
-        # Add all necessary services to a single server
-        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+        # Latency of every RPC served and made by this node, on http://<ip>:<port>/metrics once started
+        self.metrics = metrics.Metrics(self.id)
+        self.metrics_server = None
 
-        share_id_pb2_grpc.add_IdSharingServicer_to_server(IdSharingServicer(self), self.server)
-        share_leader_id_pb2_grpc.add_LeaderIdSharingServicer_to_server(LeaderIdSharingServicer(self), self.server)
-        gamemaster_pb2_grpc.add_GameMasterServicer_to_server(GameMasterServicer(self), self.server)
-        player_pb2_grpc.add_PlayerServicer_to_server(PlayerServicer(self), self.server)
-        time_sync_pb2_grpc.add_TimeSyncServicer_to_server(time_sync.TimeSyncServicer(self), self.server)
-        set_timeout_pb2_grpc.add_TimeOutServicer_to_server(TimeOutServicer(self), self.server)
+        # Channels to the other nodes are opened once and shared by all servicers and commands
+        self.channels = self.create_channel_pool()
+        self.server = self.create_server()
 
-        self.server.add_insecure_port(self.get_node_ip(self.id))
+    def create_channel_pool(self):
+        return ChannelPool(self)
+
+    def create_timers(self):
+        return TimerWheel()
+
+    def create_server(self):
+        # Add all necessary services to a single server.
+        # Every Subscribe stream holds a worker, so there is one more for each node of the ring.
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10 + len(self.ring_ids)),
+                             interceptors=[metrics.ServerInterceptor(self.metrics)])
+
+        self.add_servicers(server, [
+            (tictactoe_pb2_grpc.add_IdSharingServicer_to_server, IdSharingServicer(self)),
+            (tictactoe_pb2_grpc.add_LeaderIdSharingServicer_to_server, LeaderIdSharingServicer(self)),
+            (tictactoe_pb2_grpc.add_GameMasterServicer_to_server, GameMasterServicer(self)),
+            (tictactoe_pb2_grpc.add_PlayerServicer_to_server, PlayerServicer(self)),
+            (tictactoe_pb2_grpc.add_TimeSyncServicer_to_server, time_sync.TimeSyncServicer(self)),
+            (tictactoe_pb2_grpc.add_TimeOutServicer_to_server, TimeOutServicer(self)),
+        ])
+
+        self.bind(server)
+        return server
+
+    def stub_channel(self, channel):
+        return LegacyChannel(channel) if self.legacy_paths else channel
+
+    # Every service is also served on its path without the package, which nodes of older versions call
+    @staticmethod
+    def add_servicers(server, servicers):
+        legacy_paths = LegacyPaths()
+        for add_servicer, servicer in servicers:
+            add_servicer(servicer, server)
+            add_servicer(servicer, legacy_paths)
+        server.add_generic_rpc_handlers((legacy_paths,))
+
+    def bind(self, server):
+        if self.port is None:
+            self.port = server.add_insecure_port(self.get_node_ip(self.id))
+        else:
+            self.port = server.add_insecure_port(f'{self.id2ip[self.id]}:{self.port}')
+            self.addresses[self.id] = f'{self.id2ip[self.id]}:{self.port}'
 
     def get_node_ip(self, id):
-        return f'{self.id2ip[id]}:2002{id}'
+        if id in self.addresses:
+            return self.addresses[id]
+        return f'{self.id2ip[id]}:{20020 + id}'
 
     def reset(self):
         if DEBUGGING:  # for debugging
             self.leader_id = 300
 
-            self.player_x_id = 100
-            self.player_o_id = 200
-            self.board = init_board()
+            self.games = {}
+            self.game_id = self.create_game(100, 200).game_id
         else:
             self.leader_id = None
 
-            self.player_x_id = None
-            self.player_o_id = None
-            self.board = None
-
-            self.waiting_for_move = False
-            self.moves_timestamps = {}
+            for session in self.games.values():
+                session.stop_waiting()
+                self._log(move_log.GAME_END, session.game_id)
+            self.games = {}
+            self.game_id = None
 
             if self.leader_timeout_timer:
                 self.leader_timeout_timer.cancel()
                 self.leader_timeout_timer = None
-            if self.curr_move_timer:
-                self.curr_move_timer.cancel()
-                self.curr_move_timer = None
+            if self.clock_sync_timer:
+                self.clock_sync_timer.cancel()
+                self.clock_sync_timer = None
 
     def start_server(self):
         self.server.start()
         print(f'Started node with id {self.id}')
-        print(f'Listening on port 2002{self.id}...')
+        print(f'Listening on port {self.port}...')
+
+    def start_metrics_server(self, port):
+        self.metrics_server = metrics.serve(self.metrics, port)
+        print(f'Serving metrics on port {self.metrics_server.server_port}...')
 
     def stop_server(self):
+        with self.subscription_lock:
+            if self.subscription is not None:
+                self.subscription.cancel()
+                self.subscription = None
+        if self.metrics_server:
+            self.metrics_server.shutdown()
         self.server.stop(0)
+        # Everything that makes calls is stopped before the channels are closed
+        self.timers.stop()
+        self.auto_moves.shutdown(wait=False)
+        self.lobby.close()
+        self.replicator.close()
+        self.channels.close()
+        if self.move_log:
+            self.move_log.close()
+        if self.archive:
+            self.archive.close()
         print(f'Stopped node with id {self.id}')
 
     def handle_input(self, inp):
@@ -121,43 +262,51 @@ class Node:
         except TypeError:
             print('Invalid arguments to the command.')
 
-    def start_election(self):
+    # The election messages travel around the ring in the background,
+    # with `wait` the initiator blocks until the LEADER message made a full circle
+    def start_election(self, wait=True):
         print('Starting election')
-        for next_node_id in self.ring_ids:
-            try:
-                with grpc.insecure_channel(self.get_node_ip(next_node_id)) as channel:
-                    print(f'Forwarding ELECTION message to node {next_node_id}')
-                    stub = share_id_pb2_grpc.IdSharingStub(channel)
-                    req = share_id_pb2.ShareIdRequest(sender_id=self.id, all_ids=','.join([str(self.id)]))
-                    res = stub.ShareId(req)
-                    break
-            except grpc.RpcError as e:
-                print('aaaa')
-                print(e)
-                continue
-        return res
+        # Election ids only have to increase for each initiator, also across restarts
+        self.election_id = max(self.election_id + 1, int(self.clock() * 1000000))
+        self.election_done.clear()
+        started = self.clock()
+        req = tictactoe_pb2.ShareIdRequest(sender_id=self.id, all_ids=append_all_ids(self, ''),
+                                           initiator_id=self.id, max_id=self.id, election_id=self.election_id)
+        self.forward_to_next_alive(tictactoe_pb2_grpc.IdSharingStub, 'ShareId', req)
+        if not wait:
+            return None
+        if not self.election_done.wait(self.election_timeout):
+            print(f'Election did not finish in {self.election_timeout}s')
+            return None
+        self.last_election_time = self.clock() - started
+        print(f'Election finished in {self.last_election_time:.3f}s')
+        return True
+
+    def election_finished(self):
+        self.election_done.set()
+
+    # Ring messages skip the nodes that don't respond, suspected nodes are only tried after all the others.
+    # Only the leader is watched, so the ring is not sorted on every hop.
+    def forward_to_next_alive(self, stub_cls, method, request):
+        suspected = [node_id for node_id in self.detectors if self.suspects(node_id) and node_id in self.ring_ids]
+        node_ids = itertools.chain((node_id for node_id in self.ring_ids if node_id not in suspected), suspected)
+        self.channels.cast_to_next_alive(node_ids, stub_cls, method, request, timeout=self.rpc_timeout)
 
     def notify_leader(self):
-        with grpc.insecure_channel(self.get_node_ip(self.leader_id)) as channel:
-            stub = share_leader_id_pb2_grpc.LeaderIdSharingStub(channel)
-            res = stub.NotifyLeader(share_leader_id_pb2.NotifyLeaderRequest())
-            return res
+        width, height, k = self.variant
+        return self.channels.call(self.leader_id, tictactoe_pb2_grpc.LeaderIdSharingStub, 'NotifyLeader',
+                                  tictactoe_pb2.NotifyLeaderRequest(width=width, height=height, k=k))
 
     def exit_game(self, message):
-        for node_ip, node_id in zip(self.ring_ips[:-1], self.ring_ids[:-1]):
-            try:
-                with grpc.insecure_channel(self.get_node_ip(node_id)) as channel:
-                    stub = player_pb2_grpc.PlayerStub(channel)
-                    stub.ExitGame(player_pb2.SendMessageRequest(message=message))
-            except grpc.RpcError:
-                continue
+        self.channels.broadcast(self.ring_ids[:-1], tictactoe_pb2_grpc.PlayerStub, 'ExitGame',
+                                tictactoe_pb2.SendMessageRequest(message=message), timeout=self.rpc_timeout)
 
     def start_game(self):
         n_retries = 1
         retries = -1
         while not retries == n_retries:
             status = self.start_election()
-            if not status or len(self.alive_ids) < 3:
+            if not status or self.alive_count < self.min_players + 1:
                 print('Game start failed. There aren\'t enough nodes online to start a game.')
                 retries += 1
                 print(f'Sleeping for 10s, then maybe retrying election. {n_retries - retries} retries left.')
@@ -166,7 +315,7 @@ class Node:
             else:
                 break
 
-        if not status or len(self.alive_ids) < 3:
+        if not status or self.alive_count < self.min_players + 1:
             print('The game cannot be started. Exiting...')
             self.exit_game('not enough nodes online.')
             self.stop_server()
@@ -178,16 +327,112 @@ class Node:
             print('Triggering leader failed.')
             return
 
-    def setup_game_data_and_request_the_first_move(self):
+    def setup_game_data_and_request_the_first_move(self, variant=None):
         self._is_leader_check(self.id)
+        # Games of the previous leader, or a second notification after a failover
+        if self.resume_games() or self.games:
+            return
+
+        player_x_id, player_o_id = random.sample(self._get_player_ids(), 2)
 
-        player_ids = self._get_player_ids()
-        self.player_x_id = random.choice(player_ids)
-        self.player_o_id = player_ids[0] if self.player_x_id == player_ids[1] else player_ids[1]
+        session = self.create_game(player_x_id, player_o_id, variant or self.variant)
+        self.send_message_players('THE GAME HAS STARTED', session)
+        self.get_turn(session)
 
-        self.board = init_board()
-        self.send_message_players('THE GAME HAS STARTED')
-        self.get_turn(self.player_x_id)
+    # With `wait` False the game may not be logged yet
+    def create_game(self, player_x_id, player_o_id, variant=(3, 3, 3), wait=True):
+        session = GameSession(next(self.game_ids), player_x_id, player_o_id, variant, self.clock() + self.offset)
+        self.games[session.game_id] = session
+        self._log(move_log.GAME_START, session.game_id, player_x_id, player_o_id, session.started_at, wait)
+        if session.board.variant != (3, 3, 3):
+            self._log(move_log.VARIANT, session.game_id, *move_log.variant_fields(session.board.variant), wait=wait)
+        return session
+
+    def enqueue(self, player_id, variant=(3, 3, 3), count=1):
+        self._is_leader_check(self.id)
+        if player_id not in self._get_player_ids():
+            raise Exception(f'Node {player_id} is not a player of this ring.')
+        if not 1 <= count <= self.max_enqueue:
+            raise Exception(f'A player can wait for 1 to {self.max_enqueue} games at once, not {count}.')
+        Bitboard(*variant)
+        self.lobby.enqueue(player_id, variant, count)
+
+    # Waits in the lobby of the leader for `games` games, elects a leader first if there is none
+    def join_lobby(self, games=1):
+        if self.leader_id is None and not self.start_election():
+            print('No leader could be elected.')
+            return False
+        width, height, k = self.variant
+        try:
+            res = self.channels.call(self.leader_id, tictactoe_pb2_grpc.GameMasterStub, 'Enqueue',
+                                     tictactoe_pb2.EnqueueRequest(node_id=self.id, count=int(games),
+                                                                  width=width, height=height, k=k))
+        except grpc.RpcError:
+            print("Leader isn't responding.")
+            return False
+        if not res.success:
+            print(res.error)
+            return False
+        self.lobby_joined = True
+        print('Waiting for another player...')
+        return True
+
+    # Replays the log of an earlier run, the games in progress are resumed once this node is the leader
+    def open_move_log(self, path, snapshot_every=10000):
+        started = time.perf_counter()
+        self.recovered_games = move_log.recover(path)
+        print(f'Recovered {len(self.recovered_games)} games from {path} '
+              f'in {(time.perf_counter() - started) * 1000:.1f}ms')
+        self.move_log = move_log.MoveLog(
+            path, lambda: list(self.games.values()) + list(self.recovered_games.values()), snapshot_every)
+        self._skip_game_ids(self.move_log.last_game_id)
+
+    def open_archive(self, path):
+        self.archive = GameArchive(path)
+        self._skip_game_ids(self.archive.last_game_id)
+
+    # New games get ids above `last_game_id`, the ids of an earlier run or of another leader are not used again
+    def _skip_game_ids(self, last_game_id):
+        self.game_ids = itertools.count(max(next(self.game_ids), last_game_id + 1))
+
+    def resume_games(self):
+        sessions = {**self.replica_games, **self.recovered_games}
+        self.replica_games, self.recovered_games = {}, {}
+        sessions = {game_id: session for game_id, session in sessions.items() if game_id not in self.games}
+        self.games.update(sessions)
+        self._skip_game_ids(max(self.games, default=0))
+        for session in sessions.values():
+            # The other nodes may have missed records of the previous leader
+            if self.replication:
+                self.replicator.extend(move_log.session_records(session))
+            self.send_message_players('THE GAME HAS RESUMED', session)
+            self.get_turn(session)
+        return len(sessions)
+
+    def apply_replica(self, records):
+        for record in move_log.decode_records(records):
+            move_log.apply_record(self.replica_games, record)
+
+    # Returns once the record is on disk
+    # Returns the sequence number to wait for if `wait` is False, 0 without a move log
+    def _log(self, kind, game_id, a=0, b=0, timestamp=0.0, wait=True):
+        if self.replication:
+            self.replicator.append(kind, game_id, a, b, timestamp)
+        if not self.move_log:
+            return 0
+        seq = self.move_log.append(kind, game_id, a, b, timestamp)
+        if wait:
+            self.move_log.wait(seq)
+        return seq
+
+    def get_session(self, game_id=0):
+        session = self.games.get(game_id)
+        if session is None:
+            # Requests without a game id go to the only game hosted by this leader
+            if not game_id and len(self.games) == 1:
+                return next(iter(self.games.values()))
+            raise Exception(f'Game {game_id} does not exist.')
+        return session
 
     def sync_clocks(self):
         if self.leader_id is None:
@@ -198,96 +443,319 @@ class Node:
             return
 
         clients = self._get_player_ids()
-        current_time = time.time()
-        cls_times = itertools.product(clients, [current_time])
-        print("Initialization of clock sync with time", current_time)
-
-        # send time to all nodes and get current diffs
-        def send_time(inpt):
-            client_id, curr_time = inpt
-            with grpc.insecure_channel(self.get_node_ip(client_id)) as channel:
-                stub = time_sync_pb2_grpc.TimeSyncStub(channel)
-                req = time_sync_pb2.TimeRequest(stime=curr_time)
-                off_res = stub.GetOffset(req)
-            return client_id, off_res.offset
-
-        with futures.ThreadPoolExecutor(max_workers=len(clients)) as executor:
-            offsets = executor.map(send_time, cls_times)
+        print(f"Initialization of clock sync with {self.clock_sync_samples} samples per node")
+
+        # measure the difference between the clocks of every node and this one
+        deltas, failures = time_sync.sample_deltas(self, clients, self.clock_sync_samples, self.rpc_timeout)
+        for client_id in failures:
+            print(f"Node {client_id} didn't respond, leaving it out of the clock sync")
 
         # calculate actual offsets
-        client_offsets, master_offset = time_sync.master_time_sync(dict(offsets))
+        client_offsets, master_offset = time_sync.master_time_sync(
+            {client_id: delta for client_id, (_, delta) in deltas.items()})
 
         # send offsets to all nodes
-        def send_offset(inpt):
-            client_id, offset = inpt
-            with grpc.insecure_channel(self.get_node_ip(client_id)) as channel:
-                stub = time_sync_pb2_grpc.TimeSyncStub(channel)
-                req = time_sync_pb2.OffsetRequest(offset=offset)
-                stub.SetOffset(req)
-            print(f"Sent offset {offset} to node {client_id}")
-
-        with futures.ThreadPoolExecutor(max_workers=len(clients)) as executor:
-            executor.map(send_offset, list(client_offsets.items()))
+        self.channels.broadcast(client_offsets.keys(), tictactoe_pb2_grpc.TimeSyncStub, 'SetOffset',
+                                {client_id: tictactoe_pb2.OffsetRequest(offset=offset)
+                                 for client_id, offset in client_offsets.items()},
+                                timeout=self.rpc_timeout)
+        for client_id, offset in client_offsets.items():
+            print(f"Sent offset {offset} to node {client_id} (round trip {deltas[client_id][0] * 1000:.2f}ms)")
 
         # set offset of leader node
         self.offset = master_offset
         print("Clock sync completed successfully. Offset of leader node is", self.offset, "seconds")
 
-    def get_turn(self, player_id):
+    # Syncs the clocks in the background right away and then every `clock_sync_interval`
+    def start_clock_sync(self, delay=0):
+        if self.clock_sync_timer:
+            self.clock_sync_timer.cancel()
+        self.clock_sync_timer = self.timers.schedule(delay, self._resync_clocks)
+
+    def _resync_clocks(self):
+        self.clock_sync_timer = None
+        if self.leader_id != self.id:
+            return
+        try:
+            self.sync_clocks()
+        finally:
+            self.start_clock_sync(self.clock_sync_interval)
+
+    def set_leader(self, leader_id):
+        self.leader_id = leader_id
+        if leader_id != self.id:
+            self.subscribe_to_leader()
+
+    def subscribe_to_leader(self):
+        with self.subscription_lock:
+            leader_id = self.leader_id
+            if self.subscription is not None:
+                if self.subscription_leader_id == leader_id and not self.subscription.done():
+                    return
+                self.subscription.cancel()
+            self.watch(leader_id)
+            # The stream has its own channel, closed with the subscription
+            channel = grpc.insecure_channel(self.get_node_ip(leader_id), options=CHANNEL_OPTIONS)
+            self.subscription = self._subscribe(channel)
+            self.subscription_leader_id = leader_id
+        Thread(target=self._receive_events, args=(leader_id, channel, self.subscription), daemon=True).start()
+
+    def _subscribe(self, channel):
+        return tictactoe_pb2_grpc.GameMasterStub(self.stub_channel(channel)).Subscribe(tictactoe_pb2.SubscribeRequest(
+            node_id=self.id, heartbeat_interval=self.heartbeat_interval))
+
+    # A stream that ended is opened again as long as it is the current one and the leader didn't change,
+    # until then the leader falls back to unary calls
+    def _receive_events(self, leader_id, channel, subscription):
+        backoff = self.resubscribe_backoff[0]
+        try:
+            while True:
+                try:
+                    for event in subscription:
+                        self.handle_event(event)
+                        backoff = self.resubscribe_backoff[0]
+                except grpc.RpcError:
+                    pass
+                time.sleep(backoff)
+                backoff = min(2 * backoff, self.resubscribe_backoff[1])
+                with self.subscription_lock:
+                    if self.subscription is not subscription or self.leader_id != leader_id:
+                        return
+                    subscription = self.subscription = self._subscribe(channel)
+        finally:
+            channel.close()
+
+    # Only the current leader is watched, a previous leader that comes back is not suspected forever
+    def watch(self, node_id):
+        self.detectors = {node_id: PhiAccrualDetector(self.heartbeat_interval)}
+
+    def leader_phi(self):
+        detector = self.detectors.get(self.leader_id)
+        return detector.phi() if detector else None
+
+    def suspects(self, node_id):
+        detector = self.detectors.get(node_id)
+        return detector is not None and detector.phi() >= self.phi_threshold
+
+    def handle_event(self, event):
+        detector = self.detectors.get(self.subscription_leader_id)
+        if detector:
+            detector.heartbeat()
+        if event.type == tictactoe_pb2.GameEvent.HEARTBEAT:
+            self.last_res_from_leader_timestamp = self.clock() + self.offset
+        elif event.type == tictactoe_pb2.GameEvent.END:
+            self.on_game_end(event.message, event.game_id)
+        elif event.type == tictactoe_pb2.GameEvent.BOARD:
+            board = self.local_board(event.game_id)
+            board[event.position] = event.symbol
+            self.on_leader_message(None, event.game_id)
+            print_board(board, self.game_variants.get(event.game_id, (3, 3, 3))[0])
+        else:
+            self.on_leader_message(event.message, event.game_id, event.type == tictactoe_pb2.GameEvent.TURN,
+                                   event.player_ids, (event.width, event.height, event.k) if event.width else None)
+
+    # Board of the game as seen from the events pushed by the leader
+    def local_board(self, game_id):
+        board = self.boards.get(game_id)
+        if board is None:
+            width, height, _ = self.game_variants.get(game_id, (3, 3, 3))
+            board = self.boards[game_id] = [E] * (width * height)
+        return board
+
+    def on_leader_message(self, message, game_id, turn=False, player_ids=(), variant=None):
+        if message:
+            print(message, end='\n> ')
+        if game_id:
+            self.game_id = game_id
+        if player_ids:
+            self.game_players[game_id] = list(player_ids)
+        if variant:
+            self.game_variants[game_id] = variant
+        self.reset_leader_timeout_timer()
+        self.last_res_from_leader_timestamp = self.clock() + self.offset
+        # Moves are sent from their own thread, handlers and the event stream don't wait for the leader
+        if turn and self.auto_play:
+            try:
+                self.auto_moves.submit(self.play_auto_move, game_id)
+            except RuntimeError:
+                # An event that was already received when the node stopped
+                pass
+
+    def play_auto_move(self, game_id):
+        # While the events are streamed the board is known locally and no call is needed to pick the move
+        pos = None
+        # Only 3 x 3 boards are solved, the leader picks the move on the others
+        if self.subscription is not None and not self.subscription.done() \
+                and self.game_variants.get(game_id, (3, 3, 3)) == (3, 3, 3):
+            try:
+                pos = solver.best_move(self.local_board(game_id))
+            except ValueError:
+                pass
+        if pos is not None and self.send_turn(pos + 1, game_id):
+            return
+        res = self.get_suggestion(game_id)
+        if res is not None and res.success and res.position >= 0:
+            self.send_turn(res.position + 1, game_id)
+
+    def on_game_end(self, message, game_id):
+        print(message)
+        self.boards.pop(game_id, None)
+        self.listed_boards.pop(game_id, None)
+        self.game_players.pop(game_id, None)
+        self.game_variants.pop(game_id, None)
+        self.leave_game(game_id)
+        print('Resetting the game...', end='\n> ')
+
+    # Pushes the event through the player's stream if it has one, otherwise makes a unary call
+    def notify_player(self, node_id, message, game_id=0, event_type=tictactoe_pb2.GameEvent.MESSAGE, session=None):
+        self.notify_players([node_id], message, game_id, event_type, session)
+
+    # The players and the board of `session` are sent along, to the players of a game that starts or resumes
+    def notify_players(self, node_ids, message, game_id=0, event_type=tictactoe_pb2.GameEvent.MESSAGE,
+                       session=None):
+        game = {}
+        if session is not None:
+            width, height, k = session.board.variant
+            game = dict(player_ids=session.player_ids(), width=width, height=height, k=k)
+        event = tictactoe_pb2.GameEvent(type=event_type, game_id=game_id, message=message, **game)
+        unsubscribed_ids = [node_id for node_id in node_ids if not self.events.publish(node_id, event)]
+        if not unsubscribed_ids:
+            return {}
+        method = 'EndGame' if event_type == tictactoe_pb2.GameEvent.END else 'SendMessage'
+        _, failures = self.channels.broadcast(unsubscribed_ids, tictactoe_pb2_grpc.PlayerStub, method,
+                                              tictactoe_pb2.SendMessageRequest(
+                                                  message=message, game_id=game_id,
+                                                  turn=event_type == tictactoe_pb2.GameEvent.TURN, **game),
+                                              timeout=self.rpc_timeout)
+        return failures
+
+    def publish_move(self, session, pos, symbol):
+        event = tictactoe_pb2.GameEvent(type=tictactoe_pb2.GameEvent.BOARD, game_id=session.game_id,
+                                        position=pos, symbol=symbol)
+        for player_id in session.player_ids():
+            self.events.publish(player_id, event)
+
+    def get_turn(self, session):
+        with session.lock:
+            player_id = self._arm_turn(session)
+        self._send_turn(session, player_id)
+
+    # Called with the lock of the game held, the turn is sent with _send_turn once the lock is released:
+    # a player that is not subscribed is called, and that must not hold up the moves and boards of the game
+    def _arm_turn(self, session):
         print('Get turn')
-        self._is_player_check(player_id)
-        with grpc.insecure_channel(self.get_node_ip(player_id)) as channel:
-            stub = player_pb2_grpc.PlayerStub(channel)
-            _ = stub.SendMessage(player_pb2.SendMessageRequest(message="Turn has been requested by the Game Master"))
         # add basic timer to manage timeouts
-        # state for this timer is changed in server code
-        # in SetSymbol method
-        self.waiting_for_move = True
-        self.curr_move_timer = Timer(self.player_timeout, self._finish_if_still_waiting)
-        self.curr_move_timer.start()
-
-    def send_message_players(self, message):
-        for node_id in self.ring_ids[:-1]:
-            try:
-                with grpc.insecure_channel(self.get_node_ip(node_id)) as channel:
-                    stub = player_pb2_grpc.PlayerStub(channel)
-                    _ = stub.SendMessage(player_pb2.SendMessageRequest(message=message))
-            except grpc.RpcError:
-                continue
-
-    def send_turn(self, pos):
+        # state for this timer is changed in set_symbol
+        session.waiting_for_move = True
+        session.turn_generation += 1
+        session.curr_move_timer = self.timers.schedule(self.player_timeout, self._finish_if_still_waiting,
+                                                       session.game_id, session.turn_generation)
+        return session.player_id_for(which_turn(session.board))
+
+    def _send_turn(self, session, player_id):
+        # A player that missed the start of the game learns the other player with its turn
+        self.notify_player(player_id, "Turn has been requested by the Game Master", session.game_id,
+                           tictactoe_pb2.GameEvent.TURN, session)
+
+    def send_message_players(self, message, session=None):
+        node_ids = session.player_ids() if session else self.ring_ids[:-1]
+        game_id = session.game_id if session else 0
+        # The players learn who they play with, to agree with each other when the leader goes down
+        self.notify_players(node_ids, message, game_id, session=session)
+
+    def send_turn(self, pos, game_id=None):
         # print('Send turn',  end='\n> ')
         pos = int(pos) - 1  # convert to 0-based index
         self._is_player_check(self.id)
         try:
-            with grpc.insecure_channel(self.get_node_ip(self.leader_id)) as channel:
-                stub = gamemaster_pb2_grpc.GameMasterStub(channel)
-                res = stub.SetSymbol(gamemaster_pb2.SetSymbolRequest(node_id=self.id, position=pos))
-                if res.success:
-                    self.last_res_from_leader_timestamp = time.time() + self.offset
-                    self.reset_leader_timeout_timer()
-                    # print('Symbol set successfully', end='\n> ')
-                else:
-                    print(res.error)
+            res = self.channels.call(self.leader_id, tictactoe_pb2_grpc.GameMasterStub, 'SetSymbol',
+                                     tictactoe_pb2.SetSymbolRequest(node_id=self.id, position=pos,
+                                                                    game_id=game_id or self.game_id or 0))
+            if res.success:
+                self.last_res_from_leader_timestamp = self.clock() + self.offset
+                self.reset_leader_timeout_timer()
+                if self.failover_started is not None:
+                    self._failover_finished()
+                # print('Symbol set successfully', end='\n> ')
+            else:
+                print(res.error)
+            return res.success
         except grpc.RpcError as e:
             print("Leader isn't responding.")
+            return False
+
+    # Moves of this player in many games at once: (1-based position, game id).
+    # Returns the error of every move, None if it was made, or None if the leader is not responding.
+    def send_turns(self, moves):
+        try:
+            res = self.channels.call(self.leader_id, tictactoe_pb2_grpc.GameMasterStub, 'SetSymbolBatch',
+                                     tictactoe_pb2.SetSymbolBatchRequest(moves=[
+                                         tictactoe_pb2.SetSymbolRequest(node_id=self.id, position=int(pos) - 1,
+                                                                        game_id=game_id)
+                                         for pos, game_id in moves]))
+        except grpc.RpcError:
+            print("Leader isn't responding.")
+            return None
+        self.last_res_from_leader_timestamp = self.clock() + self.offset
+        self.reset_leader_timeout_timer()
+        return [result.error if not result.success else None for result in res.results]
 
-    def list_board(self):
+    def list_board(self, game_id=None):
         self._is_player_check(self.id)
         try:
-            with grpc.insecure_channel(self.get_node_ip(self.leader_id)) as channel:
-                stub = gamemaster_pb2_grpc.GameMasterStub(channel)
-                res = stub.ListBoard(gamemaster_pb2.ListBoardRequest())
-                print(res.move_timestamps)
-                print_board(res.board)
-                self.last_res_from_leader_timestamp = time.time() + self.offset
-                self.reset_leader_timeout_timer()
+            game_id = game_id or self.game_id or 0
+            cached = self.listed_boards.get(game_id)
+            res = self.channels.call(self.leader_id, tictactoe_pb2_grpc.GameMasterStub, 'ListBoard',
+                                     tictactoe_pb2.ListBoardRequest(game_id=game_id,
+                                                                    if_changed_since=cached.version if cached else 0))
+            # Empty when nothing moved since the cached board
+            if res.board or res.cells:
+                self.listed_boards[game_id] = res
+            else:
+                res = cached
+            if res.cells:
+                board = unpack_cells(res.cells, res.width * res.height)
+            else:
+                board = list(res.board)
+            if len(board) == 9:
+                print(format_move_timestamps(res.timestamps))
+            else:
+                print(format_move_timestamps(res.timestamps, [i for i, symbol in enumerate(board) if symbol != E]))
+            print_board(board, res.width or 3)
+            self.last_res_from_leader_timestamp = self.clock() + self.offset
+            self.reset_leader_timeout_timer()
+            return res
         except grpc.RpcError as e:
             print("Leader isn't responding.")
+            return None
+
+    def get_suggestion(self, game_id=None):
+        self._is_player_check(self.id)
+        try:
+            res = self.channels.call(self.leader_id, tictactoe_pb2_grpc.GameMasterStub, 'SuggestMove',
+                                     tictactoe_pb2.SuggestMoveRequest(game_id=game_id or self.game_id or 0))
+        except grpc.RpcError:
+            print("Leader isn't responding.")
+            return None
+        if not res.success:
+            print(res.error)
+        elif res.position < 0:
+            print('The game is over.')
+        else:
+            outcome = {1: 'wins', 0: 'draws', -1: 'loses'}[res.value]
+            print(f'Best move is {res.position + 1}, with perfect play the player to move {outcome}')
+        return res
+
+    # Position (-1 once the game is over) and value for the player to move, looked up in the solver table
+    def suggest_move(self, game_id=0):
+        self._is_leader_check(self.id)
+        board = self.get_session(game_id).board
+        pos = solver.best_move(board)
+        return -1 if pos is None else pos, solver.position_value(board)
 
-    def get_winner(self):
+    def get_winner(self, game_id=0):
         self._is_leader_check(self.id)
-        winner = get_winner(self.board)
+        winner = get_winner(self.get_session(game_id).board)
         if winner is None:
             raise Exception('The game is not over yet')
         winner = get_symbol_char(winner)
@@ -311,99 +779,250 @@ class Node:
 
         elif self.id == node_id:
             # adjust the existing node time offset
-            now = time.time() + self.offset
+            now = self.clock() + self.offset
             offset = new_total_seconds - now
             self.offset = offset
             print(f'New offset for {node_name} is {offset}.')
         else:
             try:
-                with grpc.insecure_channel(self.get_node_ip(node_id)) as channel:
-                    stub = time_sync_pb2_grpc.TimeSyncStub(channel)
-                    res = stub.AdjustOffset(time_sync_pb2.OffsetRequest(offset=new_total_seconds))
-                    print(f'New offset for {node_name} is {res.offset}.')
+                res = self.channels.call(node_id, tictactoe_pb2_grpc.TimeSyncStub, 'AdjustOffset',
+                                         tictactoe_pb2.OffsetRequest(offset=new_total_seconds))
+                print(f'New offset for {node_name} is {res.offset}.')
             except grpc.RpcError:
                 print(f'Error setting {node_name} time.')
 
     def set_time_out(self, node_type, minutes):
-        if type == 'players':
+        minutes = float(minutes)
+        if node_type == 'players':
             self.player_timeout = minutes * 60
         else:
             self.leader_timeout = minutes * 60
 
-        for node_id in self.ring_ids[:-1]:
-            with grpc.insecure_channel(self.get_node_ip(node_id)) as channel:
-                stub = set_timeout_pb2_grpc.TimeOutStub(channel)
-                res = stub.SetTimeOut(set_timeout_pb2.SetTimeOutRequest(type=node_type, timeout=int(minutes * 60)))
+        results, failures = self.channels.broadcast(
+            self.ring_ids[:-1], tictactoe_pb2_grpc.TimeOutStub, 'SetTimeOut',
+            tictactoe_pb2.SetTimeOutRequest(type=node_type, timeout=int(minutes * 60)), timeout=self.rpc_timeout)
 
-        if res.success:
+        if not failures and all(res.success for res in results.values()):
             print(f'New time out for {node_type} = {minutes} minutes')
+        else:
+            print(f'Setting the time out failed on nodes {sorted(failures)}')
+
+    def set_symbol(self, player_id, pos_symbol, game_id=0):
+        _, announce = self._make_move(player_id, pos_symbol, game_id)
+        announce()
 
-    def set_symbol(self, player_id, pos_symbol):
+    # With `wait` False the move may not be logged yet. The sequence number to wait for is returned, with the
+    # function that announces the move to the players, which is only called once the move is logged.
+    def _make_move(self, player_id, pos_symbol, game_id, wait=True):
         self._is_leader_check(self.id)
+        session = self.get_session(game_id)
         # Check whose turn it is and only allow them to make a move
         # IMPORTANT NOTE: here we are just checking for node id, so it is
         # more than possible to cheat the game by sending requests from a fake id.
         # The correct solution would be to use tokens. However since this is not the
         # focus of this work, we deliberately skip this step.
-        current_player = which_turn(self.board)
-        if (current_player == X and player_id != self.player_x_id) or \
-                (current_player == O and player_id != self.player_o_id):
-            raise Exception(f'It is not your turn. Please wait for another player to make a move')
-
-        set_symbol(self.board, pos_symbol, which_turn(self.board))
-        self.moves_timestamps[pos_symbol] = datetime.datetime.fromtimestamp(time.time() + self.offset)
-        if self.is_game_over():
-            winner = self.get_winner()
-            self.end_game(message=f'Player {winner} won the game!')
-        else:
-            next_player = which_turn(self.board)
-            self.get_turn(self.player_x_id if next_player == X else self.player_o_id)
-
-    def get_board(self):
+        with session.lock:
+            if session.over:
+                raise Exception(f'Game {session.game_id} is over.')
+            current_player = which_turn(session.board)
+            if player_id != session.player_id_for(current_player):
+                raise Exception(f'It is not your turn. Please wait for another player to make a move')
+
+            set_symbol(session.board, pos_symbol, current_player)
+            session.stop_waiting()
+            moved_at = self.clock() + self.offset
+            session.moves_timestamps[pos_symbol] = moved_at
+            # The move is only acknowledged once it is logged
+            seq = self._log(move_log.MOVE, session.game_id, pos_symbol, current_player, moved_at, wait)
+            winner = get_winner(session.board)
+            if winner is not None:
+                message = f'Player {get_symbol_char(winner)} won the game!'
+            elif session.board.is_full():
+                message = 'The game ended in a draw!'
+            else:
+                message = None
+                next_player_id = self._arm_turn(session)
+            session.over = message is not None
+
+        # Notifying the players and restarting don't need the lock
+        def announce():
+            self.publish_move(session, pos_symbol, current_player)
+            if message is None:
+                self._send_turn(session, next_player_id)
+            else:
+                self.end_game(message=message, game_id=session.game_id)
+        return seq, announce
+
+    # Makes the moves (player id, position, game id) in order and returns the error of every one, None if it
+    # was made. The moves are logged together, so the batch waits for a single fsync instead of one per move.
+    def set_symbols(self, moves):
+        errors = []
+        announcements = []
+        last_seq = 0
+        for player_id, pos_symbol, game_id in moves:
+            try:
+                seq, announce = self._make_move(player_id, pos_symbol, game_id, wait=False)
+                last_seq = max(last_seq, seq)
+                announcements.append(announce)
+                errors.append(None)
+            except Exception as exc:
+                errors.append(exc.args[0])
+        if last_seq:
+            self.move_log.wait(last_seq)
+        # No player hears of a move, or gets the next turn, before the move is on disk
+        for announce in announcements:
+            announce()
+        return errors
+
+    def get_board(self, game_id=0):
         self._is_leader_check(self.id)
-        return self.board
+        return self.get_session(game_id).board
 
-    def get_move_timestamps(self):
+    # The response is only built again after a move, and is empty if the client has the current version
+    def list_board_snapshot(self, game_id=0, if_changed_since=0):
         self._is_leader_check(self.id)
-        return self.moves_timestamps
-
-    def is_game_over(self):
-        return get_winner(self.board) is not None
+        session = self.get_session(game_id)
+        with session.lock:
+            version = session.version
+            if if_changed_since == version:
+                return tictactoe_pb2.ListBoardResponse(version=version)
+            snapshot = session.snapshot
+            if snapshot is None or snapshot.version != version:
+                board = session.board
+                width, height, k = board.variant
+                timestamps = session.moves_timestamps
+                snapshot = tictactoe_pb2.ListBoardResponse(version=version, width=width, height=height, k=k,
+                                                           cells=pack_cells(board))
+                # Clients of older versions only read the lists
+                if board.variant == (3, 3, 3):
+                    snapshot.board.extend(board)
+                    snapshot.timestamps.extend(timestamps.get(i, 0) for i in range(9))
+                else:
+                    snapshot.timestamps.extend(timestamps[i] for i in sorted(timestamps))
+                session.snapshot = snapshot
+            return snapshot
 
-    def end_game(self, message):
+    def get_move_timestamps(self, game_id=0):
+        self._is_leader_check(self.id)
+        return self.get_session(game_id).moves_timestamps
+
+    def is_game_over(self, game_id=0):
+        return get_winner(self.get_session(game_id).board) is not None
+
+    def end_game(self, message, game_id=None):
+        session = None
+        if game_id is not None:
+            # Only one of a last move and a timeout gets the session
+            session = self.games.pop(game_id, None)
+            if session is None:
+                return
+            with session.lock:
+                session.over = True
+                session.stop_waiting()
+            self._log(move_log.GAME_END, session.game_id)
+            if self.archive:
+                self.archive.append(session)
         print('Resetting the game...')
-        for node_id in self.ring_ids[:-1]:
-            try:
-                with grpc.insecure_channel(self.get_node_ip(node_id)) as channel:
-                    stub = player_pb2_grpc.PlayerStub(channel)
-                    stub.EndGame(player_pb2.SendMessageRequest(message=message))
-            except grpc.RpcError:
-                continue
-        self.reset()
-        self.start_game()
+        self.notify_players(session.player_ids() if session else self.ring_ids[:-1], message, game_id or 0,
+                            tictactoe_pb2.GameEvent.END)
+        # The node itself is only reset once the last game it hosts is over, the lobby keeps the leader
+        if not self.games and self.restart_after_game and not self.lobby.running:
+            self.reset()
+            self.start_game()
+
+    def leave_game(self, game_id):
+        if game_id and self.game_id not in (None, game_id):
+            return
+        self.game_id = None
+        # Without a game there is nothing to fail over
+        if self.leader_timeout_timer:
+            self.leader_timeout_timer.cancel()
+            self.leader_timeout_timer = None
+        if not self.games and self.restart_after_game and not self.lobby_joined:
+            self.reset()
 
     def reset_leader_timeout_timer(self):
         if self.leader_timeout_timer:
             self.leader_timeout_timer.cancel()
-        self.leader_timeout_timer = Timer(self.leader_timeout, self._agree_if_leader_is_down)
-        self.leader_timeout_timer.start()
+        if self.leader_id == self.id:
+            self.leader_timeout_timer = None
+        # A stream that broke off stops the heartbeats as well, so the detector keeps watching
+        elif self.leader_id in self.detectors:
+            self.leader_timeout_timer = self.timers.schedule(self.heartbeat_interval, self._check_leader)
+        else:
+            self.leader_timeout_timer = self.timers.schedule(self.leader_timeout, self._agree_if_leader_is_down)
+
+    def _check_leader(self):
+        phi = self.leader_phi()
+        if phi is not None and phi >= self.phi_threshold:
+            print(f'Leader {self.leader_id} is suspected to be down (phi {phi:.1f})')
+            self._agree_if_leader_is_down()
+        else:
+            self.reset_leader_timeout_timer()
 
     def _agree_if_leader_is_down(self):
-        other_player_id = self.ring_ids[0] if self.ring_ids[0] != self.leader_id else self.ring_ids[1]
+        suspected_leader_id = self.leader_id
+        other_player_ids = [i for i in self.game_players.get(self.game_id, ()) if i != self.id]
+        # The leader sends the players with the start of a game and every turn
+        if other_player_ids:
+            other_player_id = other_player_ids[0]
+        # Leaders of older versions don't, in a ring of three the other player is the third node
+        elif len(self.ring_ids) == 3:
+            other_player_id = self.ring_ids[0] if self.ring_ids[0] != self.leader_id else self.ring_ids[1]
+        else:
+            print('The other player of the game is unknown. Game continues...')
+            self.reset_leader_timeout_timer()
+            return
         try:
-            with grpc.insecure_channel(self.get_node_ip(other_player_id)) as channel:
-                stub = player_pb2_grpc.PlayerStub(channel)
-                res = stub.VerifyLeaderIsDown(player_pb2.VerifyLeaderIsDownRequest())
-                if (time.time() + self.offset - res.last_req_from_leader_timestamp) > (self.leader_timeout - 15):
-                    self.end_game(message='Both players agreed that the Game Master is down. Ending game...')
-                else:
-                    print("Players didn't agree that the leader is down. Game continues...")
-                    self.reset_leader_timeout_timer()
+            res = self.channels.call(other_player_id, tictactoe_pb2_grpc.PlayerStub, 'VerifyLeaderIsDown',
+                                     tictactoe_pb2.VerifyLeaderIsDownRequest(), timeout=self.rpc_timeout)
         except grpc.RpcError:
             print("Other player isn't responding")
+            return
+        # Players without a stream from the leader (or older nodes) only know when they last heard of it
+        if res.phi:
+            agreed = res.phi >= self.phi_threshold
+        else:
+            agreed = (self.clock() + self.offset - res.last_req_from_leader_timestamp) > (self.leader_timeout - 15)
+        if agreed:
+            self.fail_over(suspected_leader_id)
+        else:
+            print("Players didn't agree that the leader is down. Game continues...")
+            self.reset_leader_timeout_timer()
+
+    # Elects a new leader, which resumes the games from its replica
+    def fail_over(self, suspected_leader_id):
+        # The other player was faster
+        if self.leader_id != suspected_leader_id:
+            return
+        print('Both players agreed that the Game Master is down. Electing a new one...')
+        self.failover_started = (self.last_res_from_leader_timestamp or self.clock() + self.offset) - self.offset
+        if not self.start_election():
+            self.failover_started = None
+            self.end_game(message='No Game Master could be elected. Ending game...')
+            return
+        # The leader was only slow, it still hosts the games
+        if self.leader_id == suspected_leader_id:
+            print('The Game Master was elected again. Game continues...')
+            self.failover_started = None
+            self.subscribe_to_leader()
+            self.reset_leader_timeout_timer()
+            return
+        self.reset_leader_timeout_timer()
+        try:
+            self.notify_leader()
+        except grpc.RpcError:
+            print('Triggering leader failed.')
+
+    def _failover_finished(self):
+        self.last_failover_time = self.clock() - self.failover_started
+        self.failover_started = None
+        print(f'Failover finished in {self.last_failover_time:.3f}s')
+        if self.last_failover_time > self.failover_bound:
+            print(f'Failover took longer than {self.failover_bound}s')
 
     def _get_player_ids(self):
-        return [i for i in self.ring_ids + [self.id] if i != self.leader_id]
+        return [i for i in dict.fromkeys(self.ring_ids + [self.id]) if i != self.leader_id]
 
     def _game_started_check(self):
         if self.leader_id is None:
@@ -411,7 +1030,9 @@ class Node:
 
     def _is_player_check(self, node_id):
         self._game_started_check()
-        if node_id not in self._get_player_ids():
+        # After a failover the leader may be a player of a game it hosts
+        if node_id not in self._get_player_ids() and \
+                not any(node_id in session.player_ids() for session in list(self.games.values())):
             raise Exception(f'{node_id} does not appear to be a valid player id.')
 
     def _is_leader_check(self, node_id):
@@ -419,10 +1040,17 @@ class Node:
         if node_id != self.leader_id:
             raise Exception(f'{node_id} does not appear to be the leader.')
 
-    def _finish_if_still_waiting(self):
-        if self.waiting_for_move:
-            print('Waiting for move timed out. Ending game...')
-            self.end_game('Waiting for move timed out')
+    def _finish_if_still_waiting(self, game_id, turn_generation):
+        session = self.games.get(game_id)
+        if session is None:
+            return
+        with session.lock:
+            # The move arrived while the timer was firing
+            if session.over or not session.waiting_for_move or session.turn_generation != turn_generation:
+                return
+            session.over = True
+        print('Waiting for move timed out. Ending game...')
+        self.end_game('Waiting for move timed out', game_id=game_id)
 
     @staticmethod
     def print_help():
@@ -430,31 +1058,72 @@ class Node:
 Commands:
 
     Start-game
+    Join-lobby [games]
     List-board
     Set-symbol <position>
+    Suggest-move
     Set-node time Node-<id> hh:mm:ss
     Set-time-out <players,leader> <minutes>
         ''')
 
-    @staticmethod
-    def _get_node_ip(node_id):
-        return f'localhost:2002{node_id}'
-
 
 if __name__ == '__main__':
-    node_ids = [1, 2, 3]
-    node_ips = ['172.19.153.223', '172.19.153.85', '172.19.154.133']
-    i = int(sys.argv[1])
-    current_node_id = node_ids[i]
-
-    n = Node(current_node_id, node_ids[i + 1:] + node_ids[:i + 1], node_ips[i], node_ips[i + 1:] + node_ips[:i + 1])
+    parser = argparse.ArgumentParser(description='Runs a node of the tic-tac-toe ring')
+    parser.add_argument('index', type=int, nargs='?',
+                        help='index of the node in the default ring of three, if no config is given')
+    parser.add_argument('--config', help='JSON file with the id and host:port of every node of the ring')
+    parser.add_argument('--id', type=int, help='id of this node in the config')
+    parser.add_argument('--aio', action='store_true', help='run the node on grpc.aio')
+    parser.add_argument('--election-compat', action='store_true',
+                        help='while older nodes are in the ring: call the other nodes on the paths without '
+                             'the package and keep the comma-joined ids of the election messages')
+    parser.add_argument('--auto', action='store_true', help='play every turn with the perfect-play move')
+    parser.add_argument('--wal', help='write-ahead log of the games hosted as the leader')
+    parser.add_argument('--archive', help='file to append the finished games hosted as the leader to')
+    parser.add_argument('--metrics-port', type=int, help='serve the RPC metrics on this port')
+    parser.add_argument('--min-players', type=int, default=2, help='players needed to start a game')
+    parser.add_argument('--variant', type=parse_variant, default=(3, 3, 3), metavar='WxHxK',
+                        help='board of the games this node starts, e.g. 15x15x5 for five in a row')
+    args = parser.parse_args()
+
+    if args.config is None:
+        if args.index is None:
+            parser.error('either the index of the node or --config and --id are required')
+        node_ids = [1, 2, 3]
+        node_ips = ['172.19.153.223', '172.19.153.85', '172.19.154.133']
+        addresses = {node_id: f'{ip}:{20020 + node_id}' for node_id, ip in zip(node_ids, node_ips)}
+        current_node_id = node_ids[args.index]
+    else:
+        if args.id is None:
+            parser.error('--id is required with --config')
+        addresses = membership.load(args.config)
+        current_node_id = args.id
+
+    node_cls = Node
+    if args.aio:
+        from aio_node import AsyncNode as node_cls
+
+    n = membership.create_node(node_cls, current_node_id, addresses)
+    n.election_compat = n.legacy_paths = args.election_compat
+    n.auto_play = args.auto
+    # The first turn shouldn't wait for the table to be built
+    if args.auto:
+        solver.get_table()
+    n.min_players = args.min_players
+    n.variant = args.variant
+    if args.wal:
+        n.open_move_log(args.wal)
+    if args.archive:
+        n.open_archive(args.archive)
     n.start_server()
+    if args.metrics_port is not None:
+        n.start_metrics_server(args.metrics_port)
 
     print('WELCOME TO THE DISTRIBUTED TIC-TAC-TOE GAME!!!')
     n.print_help()
 
     print("Positions:")
-    print_board_indexes()
+    print_board_indexes(*args.variant[:2])
 
     while True:
         try:
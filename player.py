@@ -1,28 +1,29 @@
 import os
-import time
-from protos import player_pb2, player_pb2_grpc
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
 
 
-class PlayerServicer(player_pb2_grpc.PlayerServicer):
+class PlayerServicer(tictactoe_pb2_grpc.PlayerServicer):
     def __init__(self, node):
         self.node = node
 
     def SendMessage(self, request, context):
-        print(request.message, end='\n> ')
-        self.node.reset_leader_timeout_timer()
-        self.node.last_res_from_leader_timestamp = time.time() + self.node.offset
-        return player_pb2.SendMessageResponse()
+        self.node.on_leader_message(request.message, request.game_id, request.turn, request.player_ids,
+                                    (request.width, request.height, request.k) if request.width else None)
+        return tictactoe_pb2.SendMessageResponse()
 
     def EndGame(self, request, context):
-        print(request.message)
-        self.node.reset()
-        print('Resetting the game...',  end='\n> ')
-        return player_pb2.SendMessageResponse()
+        self.node.on_game_end(request.message, request.game_id)
+        return tictactoe_pb2.SendMessageResponse()
 
     def ExitGame(self, request, context):
         print(f'Exiting game because of {request.message}')
         self.node.stop_server()
         os._exit(0)
 
+    def Replicate(self, request, context):
+        self.node.apply_replica(request.records)
+        return tictactoe_pb2.ReplicateResponse()
+
     def VerifyLeaderIsDown(self, request, context):
-        return player_pb2.VerifyLeaderIsDownResponse(last_req_from_leader_timestamp=self.node.last_res_from_leader_timestamp)
\ No newline at end of file
+        return tictactoe_pb2.VerifyLeaderIsDownResponse(last_req_from_leader_timestamp=self.node.last_res_from_leader_timestamp,
+                                                        phi=self.node.leader_phi() or 0)
\ No newline at end of file
@@ -0,0 +1,95 @@
+import collections
+import importlib
+import os
+import tempfile
+
+import grpc
+
+# Every service is in tictactoe.proto, package tictactoe.v1. Its generated modules are built on first use,
+# and again once the proto is newer than them, then imported like any other module.
+PACKAGE = 'tictactoe.v1'
+PROTO = 'tictactoe.proto'
+MODULES = ('tictactoe_pb2', 'tictactoe_pb2_grpc')
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def is_compiled():
+    proto_mtime = os.path.getmtime(os.path.join(_DIR, PROTO))
+    paths = [os.path.join(_DIR, module + '.py') for module in MODULES]
+    return all(os.path.exists(path) and os.path.getmtime(path) >= proto_mtime for path in paths)
+
+
+# Nodes started at the same time may all compile, each one writes to its own directory and the
+# modules are moved into place whole
+def compile_protos():
+    from grpc_tools import protoc
+
+    root = os.path.dirname(_DIR)
+    with tempfile.TemporaryDirectory(dir=_DIR) as out_dir:
+        if protoc.main(['grpc_tools.protoc', f'-I{root}', f'--python_out={out_dir}', f'--grpc_python_out={out_dir}',
+                        os.path.join(_DIR, PROTO)]) != 0:
+            raise RuntimeError(f'Could not compile {PROTO}')
+        for module in MODULES:
+            os.replace(os.path.join(out_dir, 'protos', module + '.py'), os.path.join(_DIR, module + '.py'))
+
+
+# Nodes of older versions serve and call the same services without the package, e.g. /GameMaster/SetSymbol
+def legacy_path(method):
+    return method.replace(f'/{PACKAGE}.', '/', 1)
+
+
+class _CallDetails(collections.namedtuple('_CallDetails', ('method', 'invocation_metadata')),
+                   grpc.HandlerCallDetails):
+    pass
+
+
+# Serves the paths without the package. The servicers are added to it like to a server,
+# and it is added to the server after them.
+class LegacyPaths(grpc.GenericRpcHandler):
+    def __init__(self):
+        self._handlers = []
+
+    def add_generic_rpc_handlers(self, handlers):
+        self._handlers.extend(handlers)
+
+    # Newer generated modules register the handlers a second time with this, once is enough
+    def add_registered_method_handlers(self, service_name, method_handlers):
+        pass
+
+    def service(self, handler_call_details):
+        if handler_call_details.method.startswith(f'/{PACKAGE}.'):
+            return None
+        details = _CallDetails(f'/{PACKAGE}.{handler_call_details.method[1:]}',
+                               handler_call_details.invocation_metadata)
+        for handler in self._handlers:
+            method_handler = handler.service(details)
+            if method_handler is not None:
+                return method_handler
+        return None
+
+
+# Stubs made on it call the paths without the package, for rings that still have older nodes
+class LegacyChannel:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def unary_unary(self, method, *args, **kwargs):
+        return self.channel.unary_unary(legacy_path(method), *args, **kwargs)
+
+    def unary_stream(self, method, *args, **kwargs):
+        return self.channel.unary_stream(legacy_path(method), *args, **kwargs)
+
+    def stream_unary(self, method, *args, **kwargs):
+        return self.channel.stream_unary(legacy_path(method), *args, **kwargs)
+
+    def stream_stream(self, method, *args, **kwargs):
+        return self.channel.stream_stream(legacy_path(method), *args, **kwargs)
+
+
+def __getattr__(name):
+    if name not in MODULES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if not is_compiled():
+        compile_protos()
+    return importlib.import_module(f'{__name__}.{name}')
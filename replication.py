@@ -0,0 +1,55 @@
+from threading import Condition, Thread, current_thread
+
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
+import move_log
+
+
+# Sends the move log records of the leader to the nodes that are elected next if it goes down:
+# the ones with the highest ids, one for every failure to survive. Like the move log, records
+# appended while the previous batch was in flight are sent together in the next one.
+# Moves are acknowledged without waiting for the replicas.
+class Replicator:
+    def __init__(self, node):
+        self.node = node
+        self._buffer = []
+        self._closed = False
+        self._cond = Condition()
+        self._sender = None
+
+    def append(self, kind, game_id, a=0, b=0, timestamp=0.0):
+        self.extend([move_log.encode_record(kind, game_id, a, b, timestamp)])
+
+    def extend(self, records):
+        with self._cond:
+            if self._closed:
+                return
+            if self._sender is None:
+                self._sender = Thread(target=self._run, daemon=True)
+                self._sender.start()
+            self._buffer.extend(records)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+                if self._closed:
+                    return
+                records, self._buffer = self._buffer, []
+            self.send(records)
+
+    def send(self, records):
+        node_ids = sorted((node_id for node_id in self.node.ring_ids if node_id != self.node.id),
+                          reverse=True)[:self.node.replicas]
+        # Nodes that are down miss these records, they only get the games started after they are back
+        self.node.channels.broadcast(node_ids, tictactoe_pb2_grpc.PlayerStub, 'Replicate',
+                                     tictactoe_pb2.ReplicateRequest(leader_id=self.node.id, records=b''.join(records)),
+                                     timeout=self.node.rpc_timeout)
+
+    # With `wait` the batch in flight is finished first, so the channels can be closed afterwards
+    def close(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait and self._sender is not None and self._sender is not current_thread():
+            self._sender.join()
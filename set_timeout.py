@@ -1,7 +1,7 @@
-from protos import set_timeout_pb2, set_timeout_pb2_grpc
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
 
 
-class TimeOutServicer(set_timeout_pb2_grpc.TimeOutServicer):
+class TimeOutServicer(tictactoe_pb2_grpc.TimeOutServicer):
     def __init__(self, node):
         self.node = node
 
@@ -10,4 +10,4 @@ class TimeOutServicer(set_timeout_pb2_grpc.TimeOutServicer):
             self.node.player_timeout = request.timeout
         else:
             self.node.leader_timeout = request.timeout
-        return set_timeout_pb2.SetTimeOutResponse(success=True)
\ No newline at end of file
+        return tictactoe_pb2.SetTimeOutResponse(success=True)
\ No newline at end of file
@@ -0,0 +1,465 @@
+import argparse
+import bisect
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from collections.abc import Sequence
+
+import grpc
+
+from election import IdSharingServicer, LeaderIdSharingServicer
+from gamemaster import GameMasterServicer
+from node import Node
+from player import PlayerServicer
+from replication import Replicator
+from set_timeout import TimeOutServicer
+import time_sync
+
+# Deadline of the calls made without one, a real call to a partitioned node would hang forever
+DEFAULT_TIMEOUT = 30
+
+
+class SimRpcError(grpc.RpcError):
+    def __init__(self, code, details=''):
+        super().__init__(details)
+        self._code = code
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+
+class SimEvent:
+    __slots__ = ('time', 'seq', 'callback', 'args', 'cancelled')
+
+    def __init__(self, time, seq, callback, args):
+        self.time = time
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.time, self.seq) < (other.time, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# Discrete-event simulation of a ring of nodes in virtual time. The nodes run the servicers and
+# the election and timeout logic of Node, only their transport, timers and clock are simulated:
+# - a message sent to the next alive node arrives after `latency` plus up to `jitter` seconds,
+#   a crashed node refuses it after the same time and a partitioned one lets the call time out;
+# - a blocking call is answered at once without advancing the clock;
+# - timers fire in virtual time, and waiting for an election runs the simulation until it is done.
+# Everything runs on the calling thread, so the same seed gives the same run.
+class Simulator:
+    def __init__(self, n_nodes=0, seed=0, latency=0.001, jitter=0.0005):
+        self.now = 0.0
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.nodes = {}
+        self.crashed = set()
+        self.cut_off = set()  # nodes on the other side of a partition from the rest
+        self._events = []
+        self._seq = itertools.count()
+        self._ids = []
+        self.reset_counters()
+        for node_id in range(1, n_nodes + 1):
+            self.add_node(node_id)
+
+    def reset_counters(self):
+        self.messages = Counter()  # method - requests sent
+        self.failures = Counter()  # method - requests that did not get an answer
+        self.bytes = 0
+        self.events_run = 0
+
+    def clock(self):
+        return self.now
+
+    def add_node(self, node_id):
+        bisect.insort(self._ids, node_id)
+        node = self.nodes[node_id] = SimNode(self, node_id, Ring(self._ids, node_id))
+        return node
+
+    # The node comes back with a clean state, like a restarted process
+    def recover(self, node_id):
+        self.crashed.discard(node_id)
+        self.nodes[node_id] = SimNode(self, node_id, Ring(self._ids, node_id))
+        return self.nodes[node_id]
+
+    def crash(self, node_id):
+        self.crashed.add(node_id)
+
+    def partition(self, node_ids):
+        self.cut_off = set(node_ids)
+
+    def heal(self):
+        self.cut_off = set()
+
+    def is_up(self, node):
+        return self.nodes.get(node.id) is node and node.id not in self.crashed
+
+    def up_ids(self):
+        return [node_id for node_id in self._ids if node_id not in self.crashed]
+
+    def schedule(self, delay, callback, *args):
+        event = SimEvent(self.now + delay, next(self._seq), callback, args)
+        heapq.heappush(self._events, event)
+        return event
+
+    # Runs the events in order until `stop` returns True, the time passes `until` or nothing is left
+    def run(self, until=None, stop=None):
+        while not (stop and stop()):
+            if not self._events or (until is not None and self._events[0].time > until):
+                if until is not None:
+                    self.now = max(self.now, until)
+                return
+            event = heapq.heappop(self._events)
+            if event.cancelled:
+                continue
+            self.now = event.time
+            self.events_run += 1
+            event.callback(*event.args)
+
+    # Seconds until the message arrives, or until the sender gives up on it with the error code
+    def route(self, sender_id, node_id, timeout):
+        if (sender_id in self.cut_off) != (node_id in self.cut_off):
+            return timeout or DEFAULT_TIMEOUT, grpc.StatusCode.DEADLINE_EXCEEDED
+        delay = self.latency + self.random.random() * self.jitter
+        if node_id not in self.nodes or node_id in self.crashed:
+            return delay, grpc.StatusCode.UNAVAILABLE
+        return delay, None
+
+    # Returns the request in its wire format, the receiver parses its own copy like a real server
+    def _encode(self, method, request):
+        data = request.SerializeToString()
+        self.messages[method] += 1
+        self.bytes += len(data)
+        return data
+
+    def _handle(self, node_id, stub_cls, method, request_cls, data):
+        servicer = self.nodes[node_id].server[stub_cls.__name__[:-len('Stub')]]
+        return getattr(servicer, method)(request_cls.FromString(data), None)
+
+    def call(self, sender_id, node_id, stub_cls, method, request, timeout=None):
+        data = self._encode(method, request)
+        _, code = self.route(sender_id, node_id, timeout)
+        if code is not None:
+            self.failures[method] += 1
+            raise SimRpcError(code)
+        try:
+            return self._handle(node_id, stub_cls, method, type(request), data)
+        except Exception as e:
+            self.failures[method] += 1
+            raise SimRpcError(grpc.StatusCode.UNKNOWN, repr(e))
+
+    # Delivers the request after the latency, `on_failure` runs once the sender knows that it did not arrive
+    def send(self, sender_id, node_id, stub_cls, method, request, timeout, on_failure):
+        data = self._encode(method, request)
+        delay, code = self.route(sender_id, node_id, timeout)
+        if code is not None:
+            self.failures[method] += 1
+            self.schedule(delay, on_failure)
+            return
+        self.schedule(delay, self._arrive, node_id, stub_cls, method, type(request), data, on_failure)
+
+    def _arrive(self, node_id, stub_cls, method, request_cls, data, on_failure):
+        # Crashed while the message was on its way
+        if node_id in self.crashed:
+            self.failures[method] += 1
+            self.schedule(self.latency, on_failure)
+            return
+        try:
+            self._handle(node_id, stub_cls, method, request_cls, data)
+        except Exception:
+            self.failures[method] += 1
+            self.schedule(self.latency, on_failure)
+
+
+# The ring as seen from one node (see membership.ring_ids) over the sorted ids that all nodes share,
+# so that ten thousand nodes don't hold ten thousand copies of it
+class Ring(Sequence):
+    def __init__(self, ids, node_id):
+        self._ids = ids
+        self._node_id = node_id
+
+    def _start(self):
+        return bisect.bisect_right(self._ids, self._node_id)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self._ids)
+        if not 0 <= i < len(self._ids):
+            raise IndexError('Ring index out of range')
+        return self._ids[(self._start() + i) % len(self._ids)]
+
+    def __iter__(self):
+        start = self._start()
+        return itertools.chain(map(self._ids.__getitem__, range(start, len(self._ids))),
+                               map(self._ids.__getitem__, range(start)))
+
+    def __contains__(self, node_id):
+        i = bisect.bisect_left(self._ids, node_id)
+        return i < len(self._ids) and self._ids[i] == node_id
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+
+# ChannelPool of a simulated node
+class SimTransport:
+    def __init__(self, sim, node):
+        self.sim = sim
+        self.node = node
+
+    def call(self, node_id, stub_cls, method, request, timeout=None):
+        return self.sim.call(self.node.id, node_id, stub_cls, method, request, timeout)
+
+    def broadcast(self, node_ids, stub_cls, method, request, timeout=None):
+        results = {}
+        failures = {}
+        for node_id in node_ids:
+            req = request[node_id] if isinstance(request, dict) else request
+            try:
+                results[node_id] = self.call(node_id, stub_cls, method, req, timeout)
+            except grpc.RpcError as e:
+                failures[node_id] = e
+        return results, failures
+
+    def cast_to_next_alive(self, node_ids, stub_cls, method, request, timeout=None):
+        node_ids = iter(node_ids)
+
+        def attempt():
+            node_id = next(node_ids, None)
+            if node_id is None:
+                print('None of the nodes is responding')
+                return
+            self.sim.send(self.node.id, node_id, stub_cls, method, request, timeout, lambda: on_failure(node_id))
+
+        def on_failure(node_id):
+            if self.sim.is_up(self.node):
+                print(f'Node {node_id} is not responding, skipping it')
+                attempt()
+
+        attempt()
+
+    def close(self):
+        pass
+
+
+# TimerWheel of a simulated node, the timers of a crashed node don't fire
+class SimTimers:
+    def __init__(self, sim, node):
+        self.sim = sim
+        self.node = node
+
+    def schedule(self, delay, callback, *args):
+        return self.sim.schedule(delay, self._fire, callback, args)
+
+    def _fire(self, callback, args):
+        if self.sim.is_up(self.node):
+            callback(*args)
+
+    def stop(self):
+        pass
+
+
+# threading.Event in virtual time: waiting runs the simulation until the flag is set or the timeout passed
+class SimFlag:
+    def __init__(self, sim):
+        self.sim = sim
+        self._set = False
+
+    def set(self):
+        self._set = True
+
+    def clear(self):
+        self._set = False
+
+    def is_set(self):
+        return self._set
+
+    def wait(self, timeout=None):
+        self.sim.run(None if timeout is None else self.sim.now + timeout, self.is_set)
+        return self._set
+
+
+# Records reach the replicas before the move is acknowledged, there is no sender thread
+class SimReplicator(Replicator):
+    def extend(self, records):
+        if not self._closed:
+            self.send(records)
+
+
+class SimNode(Node):
+    def __init__(self, sim, id, ring_ids):
+        self.sim = sim
+        super().__init__(id, ring_ids, ring_ips=())
+        self.clock = sim.clock
+        self.election_done = SimFlag(sim)
+        self.replicator = SimReplicator(self)
+        self.restart_after_game = False
+
+    def create_channel_pool(self):
+        return SimTransport(self.sim, self)
+
+    def create_timers(self):
+        return SimTimers(self.sim, self)
+
+    # Servicers by service name
+    def create_server(self):
+        return {
+            'IdSharing': IdSharingServicer(self),
+            'LeaderIdSharing': LeaderIdSharingServicer(self),
+            'GameMaster': GameMasterServicer(self),
+            'Player': PlayerServicer(self),
+            'TimeSync': time_sync.TimeSyncServicer(self),
+            'TimeOut': TimeOutServicer(self),
+        }
+
+    # Events are not streamed, players hear from the leader through unary calls and watch it with `leader_timeout`
+    def subscribe_to_leader(self):
+        pass
+
+    # All nodes read the same clock
+    def start_clock_sync(self, delay=0):
+        pass
+
+
+def _counters(sim, started_at, wall_started):
+    return {
+        'messages': sum(sim.messages.values()),
+        'failed_messages': sum(sim.failures.values()),
+        'bytes': sim.bytes,
+        'by_method': dict(sim.messages),
+        'events': sim.events_run,
+        'virtual_s': sim.now - started_at,
+        'wall_s': time.perf_counter() - wall_started,
+    }
+
+
+# Starts an election from every initiator at once and runs until all of them are done
+def run_election(sim, initiator_ids, timeout=3600):
+    sim.reset_counters()
+    started_at, wall_started = sim.now, time.perf_counter()
+    initiators = [sim.nodes[node_id] for node_id in initiator_ids]
+    for node in initiators:
+        node.start_election(wait=False)
+    sim.run(sim.now + timeout, lambda: all(node.election_done.is_set() for node in initiators))
+
+    leader_id = initiators[0].leader_id
+    return {
+        'initiators': len(initiators),
+        'converged': all(node.election_done.is_set() for node in initiators),
+        'election_s': sim.now - started_at,
+        'leader': leader_id,
+        'agreeing_nodes': sum(1 for node_id in sim.up_ids() if sim.nodes[node_id].leader_id == leader_id),
+        **_counters(sim, started_at, wall_started),
+    }
+
+
+# Starts a game on the elected leader, crashes the leader and runs until the next leader resumed the game
+def run_failover(sim, initiator_id, timeout=3600):
+    initiator = sim.nodes[initiator_id]
+    initiator.notify_leader()
+    leader = sim.nodes[initiator.leader_id]
+    (game_id, session), = leader.games.items()
+    players = [sim.nodes[player_id] for player_id in session.player_ids()]
+
+    sim.reset_counters()
+    started_at, wall_started = sim.now, time.perf_counter()
+    sim.crash(leader.id)
+
+    def resumed():
+        new_leader = sim.nodes.get(players[0].leader_id)
+        return new_leader is not leader and new_leader is not None and game_id in new_leader.games \
+            and all(player.leader_id == new_leader.id for player in players)
+
+    sim.run(sim.now + timeout, resumed)
+    return {
+        'crashed_leader': leader.id,
+        'new_leader': players[0].leader_id if resumed() else None,
+        'failover_s': sim.now - started_at,
+        **_counters(sim, started_at, wall_started),
+    }
+
+
+def run(n_nodes, seed, latency, jitter, initiators, crashed, cut_off, failover, leader_timeout, election_timeout):
+    wall_started = time.perf_counter()
+    sim = Simulator(n_nodes, seed, latency, jitter)
+    for node in sim.nodes.values():
+        node.leader_timeout = leader_timeout
+        node.election_timeout = election_timeout
+    result = {'nodes': n_nodes, 'setup_s': time.perf_counter() - wall_started}
+
+    initiator_ids = sim.random.sample(sorted(sim.nodes), initiators)
+    others = [node_id for node_id in sorted(sim.nodes) if node_id not in initiator_ids]
+    picked = sim.random.sample(others, min(crashed + cut_off, len(others)))
+    for node_id in picked[:crashed]:
+        sim.crash(node_id)
+    sim.partition(picked[crashed:])
+    result['crashed'] = crashed
+    result['cut_off'] = len(sim.cut_off)
+
+    result['election'] = run_election(sim, initiator_ids)
+    if failover:
+        result['failover'] = run_failover(sim, initiator_ids[0])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulates elections, crashes and partitions of large rings in '
+                                                 'virtual time and reports JSON results')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.001, help='one-way delay of a message in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0005, help='random delay added to every message')
+    parser.add_argument('--initiators', type=int, default=1, help='nodes that start an election at the same time')
+    parser.add_argument('--crash', type=int, default=0, help='nodes that are down before the election')
+    parser.add_argument('--partition', type=int, default=0,
+                        help='nodes cut off from the rest of the ring before the election')
+    parser.add_argument('--failover', action='store_true',
+                        help='start a game after the election, crash the leader and time the failover')
+    parser.add_argument('--leader-timeout', type=float, default=30,
+                        help='seconds without a message before the players suspect the leader')
+    parser.add_argument('--election-timeout', type=float, default=10,
+                        help='seconds a player waits for the election of the next leader during a failover')
+    parser.add_argument('--output', help='file to write the results to instead of stdout')
+    args = parser.parse_args()
+
+    results = []
+    # The nodes print every message they get, keep only the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for n_nodes in args.nodes:
+            results.append(run(n_nodes, args.seed, args.latency, args.jitter, args.initiators, args.crash,
+                               args.partition, args.failover, args.leader_timeout, args.election_timeout))
+
+    report = {'config': {key: value for key, value in vars(args).items() if key not in ('nodes', 'output')},
+              'timestamp': time.time(),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+from threading import Lock
+
+from tic_tac_toe import *
+
+# Perfect play table for every position reachable from the empty board.
+# Positions are indexed by their base-3 encoding (empty 0, X 1, O 2 for each cell),
+# every entry packs the value for the player to move (+1 win, 0 draw, -1 loss) and the best move.
+TABLE_SIZE = 3 ** 9
+NO_MOVE = 0x0F
+UNREACHABLE = 0xFF
+
+# The 8 symmetries of the board as permutations: transformed[i] = board[perm[i]]
+_ROTATION = (6, 3, 0, 7, 4, 1, 8, 5, 2)
+_REFLECTION = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+
+
+def _compose(p, q):
+    return tuple(p[q[i]] for i in range(9))
+
+
+def _symmetries():
+    perms = [tuple(range(9))]
+    for _ in range(3):
+        perms.append(_compose(perms[-1], _ROTATION))
+    return perms + [_compose(perm, _REFLECTION) for perm in perms]
+
+
+SYMMETRIES = _symmetries()
+
+# Base-3 value of a 9-bit mask with digit 1 on every set bit, the encoding of a board is
+# _TERNARY[x_mask] + 2 * _TERNARY[o_mask]
+_TERNARY = [sum(3 ** i for i in range(9) if mask >> i & 1) for mask in range(1 << 9)]
+
+_table = None
+_table_lock = Lock()
+
+
+def encode(board):
+    if isinstance(board, Bitboard):
+        return _TERNARY[board.x] + 2 * _TERNARY[board.o]
+    code = 0
+    for i, symbol in enumerate(board):
+        if symbol == X:
+            code += 3 ** i
+        elif symbol == O:
+            code += 2 * 3 ** i
+    return code
+
+
+def _canonical(cells):
+    return min((encode([cells[i] for i in perm]), perm) for perm in SYMMETRIES)
+
+
+def _build_table():
+    memo = {}  # canonical encoding - (score, best move in the canonical board)
+
+    # Negamax with scores that prefer quicker wins and slower losses
+    def solve(cells, turn):
+        code, perm = _canonical(cells)
+        if code not in memo:
+            canonical = [cells[i] for i in perm]
+            filled = 9 - canonical.count(E)
+            if get_winner(canonical) is not None:
+                memo[code] = (filled - 10, NO_MOVE)
+            elif filled == 9:
+                memo[code] = (0, NO_MOVE)
+            else:
+                best = (-100, NO_MOVE)
+                for i in range(9):
+                    if canonical[i] == E:
+                        canonical[i] = turn
+                        score = -solve(canonical, O if turn == X else X)[0]
+                        canonical[i] = E
+                        if score > best[0]:
+                            best = (score, i)
+                memo[code] = best
+        score, move = memo[code]
+        # Move index of the canonical board back to the board that was asked about
+        return score, move if move == NO_MOVE else perm[move]
+
+    table = bytearray([UNREACHABLE]) * TABLE_SIZE
+
+    def fill(cells, turn):
+        code = encode(cells)
+        if table[code] != UNREACHABLE:
+            return
+        score, move = solve(cells, turn)
+        value = (score > 0) - (score < 0)
+        table[code] = (value + 1) << 4 | move
+        if move == NO_MOVE:
+            return
+        for i in range(9):
+            if cells[i] == E:
+                cells[i] = turn
+                fill(cells, O if turn == X else X)
+                cells[i] = E
+
+    fill(init_board(), X)
+    return table
+
+
+def get_table():
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = _build_table()
+    return _table
+
+
+def _lookup(board):
+    entry = get_table()[encode(board)]
+    if entry == UNREACHABLE:
+        raise ValueError(f'Board {list(board)} is not reachable')
+    return entry
+
+
+def _solved(board):
+    return not isinstance(board, Bitboard) or board.variant == (3, 3, 3)
+
+
+# Boards other than 3 x 3 are too large for a table: wins or blocks a win if it can,
+# otherwise makes or blocks the longest line, closest to the center
+def greedy_move(board):
+    if board.winner is not None or board.is_full():
+        return None
+    own, other = (board.x, board.o) if board.turn() == X else (board.o, board.x)
+    taken = board.x | board.o
+    center_row, center_col = (board.height - 1) / 2, (board.width - 1) / 2
+
+    def score(i):
+        attack = board.line_length(own | 1 << i, i)
+        block = board.line_length(other | 1 << i, i)
+        distance = abs(i // board.width - center_row) + abs(i % board.width - center_col)
+        return attack >= board.k, block >= board.k, max(attack, block), -distance
+
+    return max((i for i in range(len(board)) if not taken >> i & 1), key=score)
+
+
+# Returns the best index for the player to move, None if the game is over
+def best_move(board):
+    if not _solved(board):
+        return greedy_move(board)
+    move = _lookup(board) & 0x0F
+    return None if move == NO_MOVE else move
+
+
+# Returns +1, 0 or -1 for the player to move under perfect play, 0 for boards that are not solved
+def position_value(board):
+    if not _solved(board):
+        return 0
+    return (_lookup(board) >> 4) - 1
+
+
+if __name__ == '__main__':
+    import time
+
+    started = time.perf_counter()
+    table = get_table()
+    print(f'Solved {TABLE_SIZE - table.count(UNREACHABLE)} positions in {time.perf_counter() - started:.3f}s')
+    assert position_value(init_board()) == 0
+
+    # Perfect play from both sides ends in a draw
+    board = Bitboard()
+    while best_move(board) is not None:
+        set_symbol(board, best_move(board), which_turn(board))
+    print_board(board)
+    assert get_winner(board) is None and board.is_full()
+
+    # O answered the center on an edge: O has to block the diagonal and still loses
+    board = Bitboard()
+    for index in [4, 1, 0]:
+        set_symbol(board, index, which_turn(board))
+    assert best_move(board) == 8
+    assert position_value(board) == -1
+
+    # Five in a row: greedy players on both sides until one of them wins or the board is full
+    board = Bitboard(15, 15, 5)
+    while best_move(board) is not None:
+        set_symbol(board, best_move(board), which_turn(board))
+    print(f'Greedy 15x15 game: winner {get_winner(board)} after {board.moves} moves')
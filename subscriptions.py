@@ -0,0 +1,45 @@
+import queue
+from threading import Lock
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+
+    def put(self, event):
+        self.queue.put(event)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+# Leader side registry of the players streaming game events, keyed by node id
+class EventHub:
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = Lock()
+
+    def subscribe(self, node_id, subscriber=None):
+        subscriber = subscriber or Subscriber()
+        with self._lock:
+            self._subscribers[node_id] = subscriber
+        return subscriber
+
+    def unsubscribe(self, node_id, subscriber):
+        with self._lock:
+            if self._subscribers.get(node_id) is subscriber:
+                del self._subscribers[node_id]
+
+    def is_subscribed(self, node_id):
+        return node_id in self._subscribers
+
+    # Returns False if the node has no open stream, so the caller can fall back to a unary call
+    def publish(self, node_id, event):
+        subscriber = self._subscribers.get(node_id)
+        if subscriber is None:
+            return False
+        subscriber.put(event)
+        return True
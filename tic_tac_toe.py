@@ -1,9 +1,127 @@
+import datetime
+
 # We assume that X is the first *starting* player and O is the second player
 
 E = -1  # Empty
 O = 0
 X = 1
 
+# The four directions a line can go through a cell: row, column and both diagonals
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+# Board of `width` x `height` cells won by `k` symbols in a row, 3 x 3 x 3 is the classic game.
+# Cells are stored as one bit per cell per symbol (cell i is row i // width, column i % width) plus a move counter.
+# Turn and winner are known without scanning the cells: a move can only complete the lines through
+# its own cell, so only those are checked, O(k) per move whatever the size of the board.
+class Bitboard:
+    def __init__(self, width=3, height=3, k=3):
+        if width < 1 or height < 1 or not 1 <= k <= max(width, height):
+            raise ValueError(f'Invalid board {width}x{height} with {k} in a row')
+        self.width = width
+        self.height = height
+        self.k = k
+        self.x = 0
+        self.o = 0
+        self.moves = 0
+        self.winner = None
+
+    @classmethod
+    def from_list(cls, board, width=3, height=3, k=3):
+        assert is_board_valid(board)
+        bitboard = cls(width, height, k)
+        for i, symbol in enumerate(board):
+            if symbol == X:
+                bitboard.x |= 1 << i
+            elif symbol == O:
+                bitboard.o |= 1 << i
+        bitboard.moves = len(board) - get_symbol_occurrences_num(board, E)
+        for i, symbol in enumerate(board):
+            if symbol != E and bitboard.line_length(bitboard.x if symbol == X else bitboard.o, i) >= k:
+                bitboard.winner = symbol
+                break
+        return bitboard
+
+    @property
+    def variant(self):
+        return self.width, self.height, self.k
+
+    def turn(self):
+        return X if self.moves % 2 == 0 else O
+
+    def set_symbol(self, index, symbol):
+        if index < 0 or index >= len(self):
+            raise IndexError(f'Index {index} out of range')
+        bit = 1 << index
+        if (self.x | self.o) & bit:
+            raise ValueError(f'Index {index} is already occupied by symbol {self[index]}')
+        if self.turn() != symbol:
+            raise ValueError(f'Invalid symbol {symbol} for turn {self.turn()}')
+        if symbol == X:
+            self.x |= bit
+            bits = self.x
+        else:
+            self.o |= bit
+            bits = self.o
+        self.moves += 1
+        if self.winner is None and self.line_length(bits, index) >= self.k:
+            self.winner = symbol
+
+    # Longest run of `bits` through the cell, counting at most k - 1 cells on each side of it
+    def line_length(self, bits, index):
+        row, col = divmod(index, self.width)
+        longest = 0
+        for dr, dc in DIRECTIONS:
+            length = 1
+            for sign in (1, -1):
+                r, c = row + sign * dr, col + sign * dc
+                while length < self.k and 0 <= r < self.height and 0 <= c < self.width \
+                        and bits >> (r * self.width + c) & 1:
+                    length += 1
+                    r, c = r + sign * dr, c + sign * dc
+            longest = max(longest, length)
+        return longest
+
+    def is_full(self):
+        return self.moves == len(self)
+
+    def to_list(self):
+        return list(self)
+
+    def __getitem__(self, index):
+        if self.x >> index & 1:
+            return X
+        if self.o >> index & 1:
+            return O
+        return E
+
+    def __len__(self):
+        return self.width * self.height
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+# 'WxHxK', e.g. '15x15x5' for five in a row on a 15 x 15 board
+def parse_variant(text):
+    width, height, k = map(int, text.lower().split('x'))
+    Bitboard(width, height, k)
+    return width, height, k
+
+
+# Cells packed 2 bits each, four to a byte starting from the low bits: 0 empty, 1 X, 2 O
+def pack_cells(board):
+    data = bytearray((len(board) + 3) // 4)
+    for i, symbol in enumerate(board):
+        if symbol != E:
+            data[i // 4] |= (1 if symbol == X else 2) << (i % 4 * 2)
+    return bytes(data)
+
+
+def unpack_cells(data, size):
+    symbols = (E, X, O)
+    return [symbols[data[i // 4] >> (i % 4 * 2) & 3] for i in range(size)]
+
 
 def init_board():
     board = [
@@ -15,8 +133,10 @@ def init_board():
 
 
 def set_symbol(board, index, symbol):
+    if isinstance(board, Bitboard):
+        return board.set_symbol(index, symbol)
     assert is_board_valid(board)
-    if index < 0 or index > len(board):
+    if index < 0 or index >= len(board):
         raise IndexError(f'Index {index} out of range')
     if board[index] != E:
         raise ValueError(f'Index {index} is already occupied by symbol {board[index]}')
@@ -26,14 +146,18 @@ def set_symbol(board, index, symbol):
 
 
 def get_symbol(board, index):
+    if isinstance(board, Bitboard):
+        return board[index]
     assert is_board_valid(board)
-    if index < 0 or index > len(board):
+    if index < 0 or index >= len(board):
         raise IndexError(f'Index {index} out of range')
     return board[index]
 
 
-# Returns O, X or E
+# Returns O, X or E. Boards given as lists are 3 x 3.
 def get_winner(board):
+    if isinstance(board, Bitboard):
+        return board.winner
     assert is_board_valid(board)
     # Check rows
     for i in range(3):
@@ -57,6 +181,8 @@ def get_symbol_occurrences_num(board, symbol):
 
 
 def is_board_valid(board):
+    if isinstance(board, Bitboard):
+        return not board.x & board.o and board.moves == bin(board.x | board.o).count('1')
     o_occurrences_num = get_symbol_occurrences_num(board, O)
     x_occurrences_num = get_symbol_occurrences_num(board, X)
     occurrences_diff = x_occurrences_num - o_occurrences_num
@@ -64,6 +190,8 @@ def is_board_valid(board):
 
 
 def which_turn(board):
+    if isinstance(board, Bitboard):
+        return board.turn()
     o_occurrences_num = get_symbol_occurrences_num(board, O)
     x_occurrences_num = get_symbol_occurrences_num(board, X)
     occurrences_diff = x_occurrences_num - o_occurrences_num
@@ -96,26 +224,36 @@ def parse_symbol(char):
         raise ValueError(f'Symbol parsing failed for symbol: {char}')
 
 
-# Note that this function also prints an empty line before and after the board
-def print_board_indexes():
-    print("""
-    1 | 2 | 3
-    ---------
-    4 | 5 | 6
-    ---------
-    7 | 8 | 9
-    """)
+def _print_rows(rows, width):
+    separator = '\n    ' + '-' * (4 * width - 3 + sum(len(cell) - 1 for cell in rows[0])) + '\n    '
+    print('\n    ' + separator.join(' | '.join(row) for row in rows) + '\n    ')
 
 
 # Note that this function also prints an empty line before and after the board
-def print_board(board):
-    print(f"""
-    {get_symbol_char(board[0])} | {get_symbol_char(board[1])} | {get_symbol_char(board[2])}
-    ---------
-    {get_symbol_char(board[3])} | {get_symbol_char(board[4])} | {get_symbol_char(board[5])}
-    ---------
-    {get_symbol_char(board[6])} | {get_symbol_char(board[7])} | {get_symbol_char(board[8])}
-    """)
+def print_board_indexes(width=3, height=3):
+    digits = len(str(width * height))
+    _print_rows([[str(r * width + c + 1).rjust(digits) for c in range(width)] for r in range(height)], width)
+
+
+# Note that this function also prints an empty line before and after the board.
+# Boards given as lists are `width` cells wide.
+def print_board(board, width=3):
+    if isinstance(board, Bitboard):
+        width = board.width
+    _print_rows([[get_symbol_char(board[i]) for i in range(r, r + width)] for r in range(0, len(board), width)],
+                width)
+
+
+# `timestamps` has the seconds since the epoch of every cell, 0 for empty cells,
+# or of the cells in `positions` only
+def format_move_timestamps(timestamps, positions=None):
+    lines = []
+    for i, timestamp in zip(positions, timestamps) if positions is not None else enumerate(timestamps):
+        if timestamp:
+            lines.append(f"{i}: {datetime.datetime.fromtimestamp(timestamp).strftime('%H:%M:%S %m/%d/%Y')}")
+        else:
+            lines.append(f"{i}: None")
+    return '\n'.join(lines) + '\n'
 
 
 if __name__ == '__main__':
@@ -144,3 +282,24 @@ if __name__ == '__main__':
 
     winner = get_winner(board)
     print(f'Winner: {winner}')
+
+    bitboard = Bitboard()
+    for index in [0, 1, 3, 2, 6]:
+        set_symbol(bitboard, index, which_turn(bitboard))
+        assert is_board_valid(bitboard)
+    assert bitboard.to_list() == board
+    assert get_winner(bitboard) == winner == X
+    assert Bitboard.from_list(board).winner == X
+    assert unpack_cells(pack_cells(bitboard), 9) == board
+
+    # Five in a row on a 15 x 15 board, the last move joins two runs of two on a diagonal
+    board = Bitboard(15, 15, 5)
+    o_moves = iter([0, 1, 2, 3, 14])
+    for row in [3, 4, 6, 7, 5]:
+        set_symbol(board, row * 15 + row, X)
+        if board.winner is None:
+            set_symbol(board, next(o_moves), O)
+    print_board(board)
+    assert board.winner == X and board.moves == 9
+    assert Bitboard.from_list(board.to_list(), 15, 15, 5).winner == X
+    assert unpack_cells(pack_cells(board), 225) == board.to_list()
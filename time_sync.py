@@ -1,6 +1,9 @@
 import time
+from concurrent import futures
 
-from protos import time_sync_pb2, time_sync_pb2_grpc
+import grpc
+
+from protos import tictactoe_pb2, tictactoe_pb2_grpc
 
 
 def master_time_sync(client_current_deltas: dict) -> tuple:
@@ -16,24 +19,70 @@ def master_time_sync(client_current_deltas: dict) -> tuple:
     return client_offsets, master_offset
 
 
-class TimeSyncServicer(time_sync_pb2_grpc.TimeSyncServicer):
+# One NTP-style exchange, t0 and t3 are read from the clock of the leader, t1 and t2 from the one of the peer.
+# Returns the round trip time without the time spent on the peer, and the difference between
+# the two clocks assuming the request and the reply took equally long.
+def measure(node, peer_id, timeout=None):
+    t0 = time.time()
+    res = node.channels.call(peer_id, tictactoe_pb2_grpc.TimeSyncStub, 'GetOffset',
+                             tictactoe_pb2.TimeRequest(stime=t0), timeout=timeout)
+    t3 = time.time()
+    if res.recv_time:
+        rtt = (t3 - t0) - (res.send_time - res.recv_time)
+        delta = ((res.recv_time - t0) + (res.send_time - t3)) / 2
+    # Older nodes only reply with their time minus t0
+    else:
+        rtt = t3 - t0
+        delta = res.offset - rtt / 2
+    return rtt, delta
+
+
+# The fastest exchanges were the least delayed by queues and pauses,
+# returns the shortest round trip time and the median difference of the faster half
+def estimate_delta(samples):
+    samples = sorted(samples)[:max(1, len(samples) // 2)]
+    deltas = sorted(delta for _, delta in samples)
+    return samples[0][0], deltas[len(deltas) // 2]
+
+
+# Samples every peer `n_samples` times one after another, the peers at the same time.
+# Returns the (round trip time, difference) estimates and the errors, both by node id.
+def sample_deltas(node, peer_ids, n_samples, timeout=None):
+    def sample(peer_id):
+        return estimate_delta([measure(node, peer_id, timeout) for _ in range(n_samples)])
+
+    results = {}
+    failures = {}
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(32, len(peer_ids)))) as executor:
+        jobs = {peer_id: executor.submit(sample, peer_id) for peer_id in peer_ids}
+        for peer_id, job in jobs.items():
+            try:
+                results[peer_id] = job.result()
+            except grpc.RpcError as e:
+                failures[peer_id] = e
+    return results, failures
+
+
+class TimeSyncServicer(tictactoe_pb2_grpc.TimeSyncServicer):
     def __init__(self, node):
         self.node = node
 
     def GetOffset(self, request, context):
         ct = time.time()
-        return time_sync_pb2.TimeReply(
-            offset=ct - request.stime
+        return tictactoe_pb2.TimeReply(
+            offset=ct - request.stime,
+            recv_time=ct,
+            send_time=time.time()
         )
 
     def SetOffset(self, request, context):
         self.node.offset = request.offset
-        return time_sync_pb2.Empty()
+        return tictactoe_pb2.Empty()
 
     def AdjustOffset(self, request, context):
         now = time.time() + self.node.offset
         self.node.offset = request.offset - now
-        return time_sync_pb2.TimeReply(offset=self.node.offset)
+        return tictactoe_pb2.TimeReply(offset=self.node.offset)
 
 
 if __name__ == '__main__':
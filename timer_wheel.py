@@ -0,0 +1,63 @@
+import math
+import time
+from concurrent import futures
+from threading import Event, Lock, Thread
+
+
+class TimerHandle:
+    __slots__ = ('wheel', 'tick', 'callback', 'args')
+
+    def __init__(self, wheel, tick, callback, args):
+        self.wheel = wheel
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+
+# Hashed timer wheel: a single thread drives every timeout of the node.
+# Arming and cancelling a timer is O(1), callbacks run on a small executor
+# so that a slow callback (e.g. one that ends a game over RPC) doesn't delay the others.
+class TimerWheel:
+    def __init__(self, tick=0.1, slots=1024, max_workers=4):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._current_tick = 0
+        self._start = time.monotonic()
+        self._lock = Lock()
+        self._stopped = Event()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='timer-wheel')
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def schedule(self, delay, callback, *args):
+        with self._lock:
+            tick = self._current_tick + max(1, math.ceil(delay / self.tick))
+            handle = TimerHandle(self, tick, callback, args)
+            self._slots[tick % len(self._slots)].add(handle)
+        return handle
+
+    def cancel(self, handle):
+        with self._lock:
+            self._slots[handle.tick % len(self._slots)].discard(handle)
+
+    def stop(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            next_tick_at = self._start + (self._current_tick + 1) * self.tick
+            delay = next_tick_at - time.monotonic()
+            if delay > 0 and self._stopped.wait(delay):
+                return
+            with self._lock:
+                self._current_tick += 1
+                slot = self._slots[self._current_tick % len(self._slots)]
+                # Handles of later rounds share the slot and stay in it
+                expired = [handle for handle in slot if handle.tick <= self._current_tick]
+                slot.difference_update(expired)
+            for handle in expired:
+                self._executor.submit(handle.callback, *handle.args)